@@ -0,0 +1,110 @@
+import argparse
+import time
+
+import ChessAI
+import ChessEngine
+import Perft
+
+try:
+    import ChessNumpy
+except ImportError:  # numpy is optional, the batch scores are only checked when it is installed
+    ChessNumpy = None
+
+# leaf evaluators to compare, the first one is the baseline the others are measured against. v5 scores the repetition
+# and castling terms differently from v4 (see score_board_v5), v3 leaves them out
+EVALUATORS = [
+    ("score_board_v4", ChessAI.score_board_v4),
+    ("score_board_v5", ChessAI.score_board_v5),
+    ("score_board_v3", ChessAI.score_board_v3),
+]
+REPEAT = 10  # evaluations per leaf, so the timer overhead does not count
+
+
+def time_leaves(gamestate, depth, evaluators, seconds):
+    # walks the move tree like perft and times every evaluator on every leaf, returns the number of leaves
+    moves = gamestate.getValidMoves()
+    if depth == 0:
+        for i, evaluate in enumerate(evaluators):
+            start = time.perf_counter()
+            for _ in range(REPEAT):
+                evaluate(gamestate)
+            seconds[i] += time.perf_counter() - start
+        return 1
+    leaves = 0
+    for move in moves:
+        gamestate.makeMove(move)
+        leaves += time_leaves(gamestate, depth - 1, evaluators, seconds)
+        gamestate.undoMove()
+    return leaves
+
+
+def benchmark_evaluators(depth, backend):
+    seconds = [0.0] * len(EVALUATORS)
+    leaves = 0
+    for name, fen, expected_counts in Perft.REFERENCE_POSITIONS:
+        gamestate = ChessEngine.new_game_state(fen, backend)
+        leaves += time_leaves(gamestate, depth, [evaluate for name, evaluate in EVALUATORS], seconds)
+
+    print(f"{leaves} leaves of the reference positions at depth {depth}, {REPEAT} evaluations each")
+    for (name, evaluate), total in zip(EVALUATORS, seconds):
+        per_leaf = total / (leaves * REPEAT)
+        print(f"{name}: {per_leaf * 1e6:.2f} us per leaf, {seconds[0] / total:.1f}x the speed of {EVALUATORS[0][0]}")
+
+
+def compare_numpy(gamestate, depth, seconds, mismatches):
+    # scores the children of every node above the leaves with score_board_v3 one by one and with NumPy in one batch,
+    # returns the number of leaves
+    moves = gamestate.getValidMoves()
+    if depth == 1:
+        start = time.perf_counter()
+        for _ in range(REPEAT):
+            batch_scores = ChessNumpy.score_children(gamestate, moves, ChessAI.POSITION_WEIGHT)
+        seconds[1] += time.perf_counter() - start
+        for move, batch_score in zip(moves, batch_scores):
+            gamestate.makeMove(move)
+            gamestate.getValidMoves()
+            start = time.perf_counter()
+            for _ in range(REPEAT):
+                score = ChessAI.score_board_v3(gamestate)
+            seconds[0] += time.perf_counter() - start
+            if score != batch_score and not gamestate.checkmate and not gamestate.stalemate:
+                mismatches.append((gamestate.board_to_fen(), score, batch_score))
+            gamestate.undoMove()
+        return len(moves)
+    leaves = 0
+    for move in moves:
+        gamestate.makeMove(move)
+        leaves += compare_numpy(gamestate, depth - 1, seconds, mismatches)
+        gamestate.undoMove()
+    return leaves
+
+
+def benchmark_numpy(depth, backend):
+    # the batch time includes making and taking back the moves, score_board_v3 reads the sums the moves keep up to date.
+    # the batches have to give exactly the scores of score_board_v3, whether or not numpy_eval is on
+    seconds = [0.0, 0.0]
+    mismatches = []
+    leaves = 0
+    for name, fen, expected_counts in Perft.REFERENCE_POSITIONS:
+        gamestate = ChessEngine.new_game_state(fen, backend)
+        leaves += compare_numpy(gamestate, depth, seconds, mismatches)
+
+    print(f"score_board_v3: {seconds[0] / (leaves * REPEAT) * 1e6:.2f} us per leaf")
+    print(f"NumPy batches: {seconds[1] / (leaves * REPEAT) * 1e6:.2f} us per leaf, including make and undo, "
+          f"{seconds[1] / seconds[0]:.1f}x the time of score_board_v3")
+    print(f"{len(mismatches)} of {leaves} leaves scored differently")
+    for fen, score, batch_score in mismatches[:10]:
+        print(f"  {fen}: {score} != {batch_score}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the leaf evaluators on the leaves of the reference positions.")
+    parser.add_argument("depth", nargs="?", type=int, default=2)
+    parser.add_argument("--backend", default=Perft.cfg["ai"]["backend"], choices=("mailbox", "bitboard"))
+    args = parser.parse_args()
+
+    benchmark_evaluators(args.depth, args.backend)
+    if ChessNumpy is not None:
+        benchmark_numpy(args.depth, args.backend)
+    else:
+        print("numpy is not installed, the NumPy batches are not checked")
@@ -0,0 +1,266 @@
+import mmap
+import os
+import sys
+import time
+from array import array
+
+import ChessEngine
+from ChessEngine import SQUARES, SQ_INDEX, EMPTY, WHITE, BLACK, PAWN, ROOK, QUEEN, KING
+
+# endgame bitbases for king and pawn, rook or queen against king, built by retrograde analysis: starting from the
+# checkmates, every position is resolved from the positions it leads to, one ply at a time.
+# a position is indexed by the side to move (0 = the stronger side), the two kings and the piece, every square
+# numbered 0 (a8) to 63 (h1) like SQ_INDEX. the stronger side is always stored as white, a black piece is probed
+# with the board mirrored. KRK and KQK keep the distance to mate in plies + 1 in a byte (0 = draw), KPK only keeps
+# one bit per position for won or not, so the file is 64 KB
+POSITIONS = 2 * 64 * 64 * 64
+TABLES = {PAWN: "kpk.bin", ROOK: "krk.bin", QUEEN: "kqk.bin"}
+BIT_TABLES = (PAWN,)  # tables stored as won or not won bits
+MAX_PHASE = ChessEngine.PHASE_VALUES["Q"]  # positions with more material never need a look into the bitbases
+
+tables = {}  # piece type -> memory-mapped table, filled by load
+
+
+def index(strong_to_move, strong_king, weak_king, piece):
+    return (0 if strong_to_move else 1) << 18 | strong_king << 12 | weak_king << 6 | piece
+
+
+def _on_board(row, col):
+    return 0 <= row < 8 and 0 <= col < 8
+
+
+# moves and lines of the 64 square board
+KING_MOVES = [[(row + dr) * 8 + col + dc for dr in (-1, 0, 1) for dc in (-1, 0, 1)
+               if (dr or dc) and _on_board(row + dr, col + dc)] for row in range(8) for col in range(8)]
+ROOK_RAYS = [[[(row + dr * i) * 8 + col + dc * i for i in range(1, 8) if _on_board(row + dr * i, col + dc * i)]
+              for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1))] for row in range(8) for col in range(8)]
+BISHOP_RAYS = [[[(row + dr * i) * 8 + col + dc * i for i in range(1, 8) if _on_board(row + dr * i, col + dc * i)]
+                for dr, dc in ((-1, -1), (-1, 1), (1, -1), (1, 1))] for row in range(8) for col in range(8)]
+PIECE_RAYS = {ROOK: ROOK_RAYS, QUEEN: [ROOK_RAYS[sq] + BISHOP_RAYS[sq] for sq in range(64)]}
+PAWN_ATTACKS = [[(row - 1) * 8 + col + dc for dc in (-1, 1) if _on_board(row - 1, col + dc)]
+                for row in range(8) for col in range(8)]  # white pawns, moving towards a8
+
+
+def attacks(piece_type, piece, target, blocker):
+    # whether the piece attacks the target square with only the blocker (the strong king) in the way
+    if piece_type == PAWN:
+        return target in PAWN_ATTACKS[piece]
+    for ray in PIECE_RAYS[piece_type][piece]:
+        for sq in ray:
+            if sq == target:
+                return True
+            if sq == blocker:
+                break
+    return False
+
+
+def adjacent(a, b):
+    return b in KING_MOVES[a]
+
+
+def legal(piece_type, strong_to_move, strong_king, weak_king, piece):
+    if len({strong_king, weak_king, piece}) < 3 or adjacent(strong_king, weak_king):
+        return False
+    if piece_type == PAWN and not 8 <= piece < 56:
+        return False
+    # the weak side cannot be in check when it is not its move
+    return not strong_to_move or not attacks(piece_type, piece, weak_king, strong_king)
+
+
+def successors(piece_type, strong_to_move, strong_king, weak_king, piece, promotions):
+    # the positions after every legal move and the best result of the moves that leave the table: the distance to
+    # mate of a promotion (from the tables of the promoted pieces), or escape = the weak king took the piece
+    moves = []
+    promotion_mate = None
+    escape = False
+    if strong_to_move:
+        for sq in KING_MOVES[strong_king]:
+            if sq != piece and sq != weak_king and not adjacent(sq, weak_king):
+                moves.append(index(False, sq, weak_king, piece))
+        if piece_type == PAWN:
+            sq = piece - 8
+            if sq != strong_king and sq != weak_king:
+                if sq < 8:
+                    for table in promotions:
+                        plies = table[index(False, strong_king, weak_king, sq)]
+                        if plies and (promotion_mate is None or plies < promotion_mate):
+                            promotion_mate = plies  # mate in plies - 1 after the promotion, in plies from here
+                else:
+                    moves.append(index(False, strong_king, weak_king, sq))
+                    if piece >= 48 and sq - 8 != strong_king and sq - 8 != weak_king:
+                        moves.append(index(False, strong_king, weak_king, sq - 8))
+        else:
+            for ray in PIECE_RAYS[piece_type][piece]:
+                for sq in ray:
+                    if sq == strong_king or sq == weak_king:
+                        break
+                    moves.append(index(False, strong_king, weak_king, sq))
+    else:
+        for sq in KING_MOVES[weak_king]:
+            if sq == strong_king or adjacent(sq, strong_king):
+                continue
+            if sq == piece:
+                escape = True  # the piece is not defended, king against king is a draw
+            elif not attacks(piece_type, piece, sq, strong_king):
+                moves.append(index(True, strong_king, sq, piece))
+    return moves, promotion_mate, escape
+
+
+def generate(piece_type, promotions=()):
+    # retrograde analysis, returns the distance to mate in plies + 1 of every position (0 = draw or illegal).
+    # promotions are the finished tables of the pieces a pawn can promote to
+    start = time.perf_counter()
+    edges = array("l")
+    edge_start = array("l", [0]) * (POSITIONS + 1)
+    remaining = array("l", [0]) * POSITIONS  # moves of the weak side not known to lose yet
+    result = bytearray(POSITIONS)
+    frontier = []  # positions lost for the weak side to move, in the current number of plies
+    promotion_wins = {}  # plies -> positions the strong side wins by promoting
+
+    # the move graph of all legal positions
+    for position in range(POSITIONS):
+        edge_start[position] = len(edges)
+        strong_to_move, strong_king, weak_king, piece = not position >> 18, position >> 12 & 63, position >> 6 & 63, position & 63
+        if not legal(piece_type, strong_to_move, strong_king, weak_king, piece):
+            continue
+        moves, promotion_mate, escape = successors(piece_type, strong_to_move, strong_king, weak_king, piece, promotions)
+        edges.extend(moves)
+        if strong_to_move:
+            if promotion_mate is not None:
+                promotion_wins.setdefault(promotion_mate, []).append(position)
+        else:
+            remaining[position] = len(moves) + escape
+            if not moves and not escape and attacks(piece_type, piece, weak_king, strong_king):
+                result[position] = 1  # checkmate
+                frontier.append(position)
+    edge_start[POSITIONS] = len(edges)
+
+    # the same graph backwards, the positions every position can be reached from
+    predecessor_start = array("l", [0]) * (POSITIONS + 1)
+    for target in edges:
+        predecessor_start[target + 1] += 1
+    for position in range(POSITIONS):
+        predecessor_start[position + 1] += predecessor_start[position]
+    predecessors = array("l", [0]) * len(edges)
+    fill = array("l", predecessor_start)
+    for position in range(POSITIONS):
+        for i in range(edge_start[position], edge_start[position + 1]):
+            target = edges[i]
+            predecessors[fill[target]] = position
+            fill[target] += 1
+
+    # ply by ply from the checkmates: the strong side wins if one move reaches a lost position, the weak side loses
+    # once all of its moves reach won positions
+    plies = 0
+    while frontier or any(mate > plies for mate in promotion_wins):
+        won = []
+        for position in frontier:
+            for i in range(predecessor_start[position], predecessor_start[position + 1]):
+                predecessor = predecessors[i]
+                if not result[predecessor]:
+                    result[predecessor] = plies + 2
+                    won.append(predecessor)
+        for position in promotion_wins.pop(plies + 1, ()):
+            if not result[position]:
+                result[position] = plies + 2
+                won.append(position)
+        frontier = []
+        for position in won:
+            for i in range(predecessor_start[position], predecessor_start[position + 1]):
+                predecessor = predecessors[i]
+                remaining[predecessor] -= 1
+                if remaining[predecessor] == 0:
+                    result[predecessor] = plies + 3
+                    frontier.append(predecessor)
+        plies += 2
+
+    print(f"{TABLES[piece_type]}: {sum(1 for value in result if value)} won positions, longest mate {max(result) - 1} "
+          f"plies, {time.perf_counter() - start:.1f}s")
+    return result
+
+
+def pack_bits(result):
+    bits = bytearray(POSITIONS // 8)
+    for position, value in enumerate(result):
+        if value:
+            bits[position >> 3] |= 1 << (position & 7)
+    return bits
+
+
+def build(folder):
+    os.makedirs(folder, exist_ok=True)
+    kqk = generate(QUEEN)
+    krk = generate(ROOK)
+    kpk = generate(PAWN, (kqk, krk))
+    for piece_type, result in ((QUEEN, kqk), (ROOK, krk), (PAWN, kpk)):
+        with open(os.path.join(folder, TABLES[piece_type]), "wb") as f:
+            f.write(pack_bits(result) if piece_type in BIT_TABLES else result)
+
+
+def load(folder):
+    # maps the tables of the folder that exist, returns how many there are
+    for piece_type, name in TABLES.items():
+        path = os.path.join(folder, name)
+        if piece_type not in tables and os.path.exists(path):
+            with open(path, "rb") as f:
+                tables[piece_type] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return len(tables)
+
+
+def probe(gamestate):
+    # (result, plies to mate) for the side to move if the bitbases know the position: result is 1 for a win, -1 for
+    # a loss and 0 for a draw, the plies are None for the tables without distances. None for any other position
+    squares = gamestate.squares
+    if squares.count(EMPTY) != 64 - 3:  # counted in C, most positions have more than 3 pieces and stop here
+        return None
+    pieces = []
+    for sq in SQUARES:
+        if squares[sq] != EMPTY:
+            pieces.append((squares[sq], SQ_INDEX[sq]))
+            if len(pieces) == 3:
+                break
+
+    piece_code, piece = next(((code, sq) for code, sq in pieces if code & 7 != KING), (EMPTY, 0))
+    table = tables.get(piece_code & 7)
+    if table is None:
+        return None
+    strong_color = piece_code & (WHITE | BLACK)
+    strong_king = next(sq for code, sq in pieces if code == strong_color | KING)
+    weak_king = next(sq for code, sq in pieces if code == strong_color ^ (WHITE | BLACK) | KING)
+    strong_is_white = strong_color == WHITE
+    if not strong_is_white:
+        # the tables are built for white, mirror the ranks
+        strong_king, weak_king, piece = strong_king ^ 56, weak_king ^ 56, piece ^ 56
+    strong_to_move = gamestate.white_to_move == strong_is_white
+    position = index(strong_to_move, strong_king, weak_king, piece)
+
+    if piece_code & 7 in BIT_TABLES:
+        if not table[position >> 3] >> (position & 7) & 1:
+            return 0, None
+        return (1 if strong_to_move else -1), None
+    value = table[position]
+    if not value:
+        return 0, None
+    return (1 if strong_to_move else -1), value - 1
+
+
+def pawn_progress(gamestate):
+    # how far a won KPK is converted: the ranks the pawn has advanced, then how close its king is to the square in
+    # front of it. the search follows it from one won position to the next until the pawn promotes
+    squares = gamestate.squares
+    pawn = king = 0
+    for sq in SQUARES:
+        if squares[sq] & 7 == PAWN:
+            pawn = sq
+    color = squares[pawn] & (WHITE | BLACK)
+    for sq in SQUARES:
+        if squares[sq] == color | KING:
+            king = sq
+    front = pawn - 10 if color == WHITE else pawn + 10
+    advanced = 6 - ChessEngine.SQ_ROW[pawn] if color == WHITE else ChessEngine.SQ_ROW[pawn] - 1
+    distance = max(abs(ChessEngine.SQ_ROW[king] - ChessEngine.SQ_ROW[front]), abs(ChessEngine.SQ_COL[king] - ChessEngine.SQ_COL[front]))
+    return 8 * advanced - distance
+
+
+if __name__ == "__main__":
+    build(sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "bitbases"))
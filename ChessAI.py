@@ -1,88 +1,33 @@
+import copy
+import multiprocessing
+import multiprocessing.util
+import os
+import queue
 import random
+import threading
+import time
 import yaml
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
-# load the config
-with open("config.yaml") as f:
+import Bitbases
+import ChessEngine
+import OpeningBook
+
+# load the config (relative to this file so headless workers can run from any directory)
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.yaml")) as f:
     cfg = yaml.load(f, Loader=yaml.FullLoader)
 
-knight_scores = [[-50, -40, -30, -30, -30, -30, -40, -50],
-                 [-40, -20, 0, 0, 0, 0, -20, -40],
-                 [-30, 0, 10, 15, 15, 10, 0, -30],
-                 [-30, 5, 15, 20, 20, 15, 5, -30],
-                 [-30, 0, 15, 20, 20, 15, 0, -30],
-                 [-30, 5, 10, 15, 15, 10, 5, -30],
-                 [-40, -20, 0, 5, 5, 0, -20, -40],
-                 [-50, -40, -30, -30, -30, -30, -40, -50]]
-
-bishop_scores = [[-20, -10, -10, -10, -10, -10, -10, -20],
-                 [-10, 0, 0, 0, 0, 0, 0, -10],
-                 [-10, 0, 5, 10, 10, 5, 0, -10],
-                 [-10, 5, 5, 10, 10, 5, 5, -10],
-                 [-10, 0, 10, 10, 10, 10, 0, -10],
-                 [-10, 10, 10, 10, 10, 10, 10, -10],
-                 [-10, 5, 0, 0, 0, 0, 5, -10],
-                 [-20, -10, -10, -10, -10, -10, -10, -20]]
-
-rook_scores = [[0, 0, 0, 0, 0, 0, 0, 0],
-               [5, 10, 10, 10, 10, 10, 10, 5],
-               [-5, 0, 0, 0, 0, 0, 0, -5],
-               [-5, 0, 0, 0, 0, 0, 0, -5],
-               [-5, 0, 0, 0, 0, 0, 0, -5],
-               [-5, 0, 0, 0, 0, 0, 0, -5],
-               [-5, 0, 0, 0, 0, 0, 0, -5],
-               [0, 0, 5, 5, 5, 5, 0, 0]]
-
-queen_scores = [[-20, -10, -10, -5, -5, -10, -10, -20],
-                [-10, 0, 0, 0, 0, 0, 0, -10],
-                [-10, 0, 5, 5, 5, 5, 0, -10],
-                [-5, 0, 5, 5, 5, 5, 0, -5],
-                [0, 0, 5, 5, 5, 5, 0, -5],
-                [-10, 5, 5, 5, 5, 5, 0, -10],
-                [-10, 0, 5, 0, 0, 0, 0, -10],
-                [-20, -10, -10, -5, -5, -10, -10, -20]]
-
-pawn_scores = [[0, 0, 0, 0, 0, 0, 0, 0],
-               [50, 50, 50, 50, 50, 50, 50, 50],
-               [10, 10, 20, 30, 30, 20, 10, 10],
-               [5, 5, 10, 25, 25, 10, 5, 5],
-               [0, 0, 0, 20, 20, 0, 0, 0],
-               [5, -5, -10, 0, 0, -10, -5, 5],
-               [5, 10, 10, -20, -20, 10, 10, 5],
-               [20, 20, 20, 20, 20, 20, 20, 20]]
-
-king_scores = [[-30, -40, -40, -50, -50, -40, -40, -30],
-               [-30, -40, -40, -50, -50, -40, -40, -30],
-               [-30, -40, -40, -50, -50, -40, -40, -30],
-               [-30, -40, -40, -50, -50, -40, -40, -30],
-               [-20, -30, -30, -40, -40, -30, -30, -20],
-               [-10, -20, -20, -20, -20, -20, -20, -10],
-               [20, 20, 0, 0, 0, 0, 20, 20],
-               [20, 30, 10, 0, 0, 10, 30, 20]]
-
-king_piece_square_table_end_game = [[-50, -40, -30, -20, -20, -30, -40, -50],
-                                    [-30, -20, -10, 0, 0, -10, -20, -30],
-                                    [-30, -10, 20, 30, 30, 20, -10, -30],
-                                    [-30, -10, 30, 40, 40, 30, -10, -30],
-                                    [-30, -10, 30, 40, 40, 30, -10, -30],
-                                    [-30, -10, 20, 30, 30, 20, -10, -30],
-                                    [-30, -30, 0, 0, 0, 0, -30, -30],
-                                    [-50, -30, -30, -30, -30, -30, -30, -50]]
-
-piece_position_scores = {"wN": knight_scores,
-                         "bN": knight_scores[::-1],
-                         "wB": bishop_scores,
-                         "bB": bishop_scores[::-1],
-                         "wQ": queen_scores,
-                         "bQ": queen_scores[::-1],
-                         "wR": rook_scores,
-                         "bR": rook_scores[::-1],
-                         "wp": pawn_scores,
-                         "bp": pawn_scores[::-1],
-                         "wK": king_scores,
-                         "bK": king_scores[::-1]}
-
-piece_value = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "p": 1}
-pieces = ["bB", "bK", "bN", "bp", "bQ", "bR", "wB", "wK", "wN", "wp", "wQ", "wR"]
+# the piece tables live in ChessEngine, the game state keeps their sums up to date while moves are made
+piece_position_scores = ChessEngine.piece_position_scores
+king_piece_square_table_end_game = ChessEngine.king_piece_square_table_end_game
+piece_value = ChessEngine.piece_value
+pieces = ChessEngine.pieces
+
+# the piece values indexed by the piece codes of the compact board, for the delta pruning of the quiescence search
+piece_values = [0] * (ChessEngine.OFFBOARD + 1)
+for piece in pieces:
+    piece_values[ChessEngine.PIECE_CODES[piece]] = piece_value[piece[1]]
 
 CHECKMATE = cfg["ai"]["points_checkmate"]
 CASTLING_SCORE = cfg["ai"]["castling_score"]
@@ -90,56 +35,465 @@ MOVE_REP_PUNISH = cfg["ai"]["move_repetition_punish"]
 POSITION_WEIGHT = cfg["ai"]["positional_weight"]
 STALEMATE = cfg["ai"]["points_stalemate"]
 DEPTH = cfg["ai"]["depth"]  # the moves that the engine looks ahead
+TIME_LIMIT = cfg["ai"]["time_limit"]  # seconds per move, 0 means no limit
+NODE_LIMIT = cfg["ai"]["node_limit"]  # nodes per move, 0 means no limit
+HASH_SIZE_MB = cfg["ai"]["hash_size_mb"]  # memory cap of the transposition table
+THREADS = cfg["ai"]["threads"]  # processes that search every position together, 1 searches in this process only
+QUIESCENCE_DEPTH = cfg["ai"]["quiescence_depth"]  # captures searched past the horizon, 0 turns it off
+DELTA_MARGIN = cfg["ai"]["delta_margin"]  # positional swing a capture may still bring beyond its material
+NUMPY_EVAL = cfg["ai"]["numpy_eval"]  # score the leaves of find_move_v3 in batches, needs numpy and is slower
+
+BOOK = cfg["ai"]["book"]  # Polyglot opening book, relative to this file, empty for none
+BOOK_MAX_PLY = cfg["ai"]["book_max_ply"]  # half moves of a game the book is asked for
+BOOK_SELECTION = cfg["ai"]["book_selection"]  # "weighted" picks a book move at random by its weight, "best" the heaviest
+BITBASES = cfg["ai"]["bitbases"]  # folder of the endgame bitbases relative to this file, built by Bitbases.py
+
+if NUMPY_EVAL:
+    import ChessNumpy
+
+opening_book = OpeningBook.PolyglotBook(os.path.join(os.path.dirname(os.path.abspath(__file__)), BOOK)) if BOOK else None
+if BITBASES:
+    Bitbases.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), BITBASES))
+
+MAX_PLY = 64  # deepest ply the killer moves are kept for
+# a checkmate scores CHECKMATE minus the plies from the root to it, so a faster mate scores higher. every score beyond
+# MATE_BOUND is a mate, the searches never get 2 * MAX_PLY plies deep
+MATE_BOUND = CHECKMATE - 2 * MAX_PLY
+BITBASE_WIN = CHECKMATE / 2  # a won endgame of the bitbases, shorter mates score higher but all below a checkmate
+
+# move ordering: the best move of the transposition table first, then captures (most valuable victim, least
+# valuable attacker), then the killer moves of the ply, then the quiet moves by their history score
+TT_MOVE_ORDER = 1 << 30
+CAPTURE_ORDER = 1 << 29
+KILLER_ORDER = 1 << 28
+ORDER_VALUES = (0, 1, 3, 3, 5, 9, 10)  # indexed by piece type, the king only ever captures as attacker
+HISTORY_NOISE = 16  # history score range the helpers of lazy SMP add at random, a cutoff at depth 4 counts as 16
+
+# bound types of the transposition table entries
+EXACT = 1
+LOWER_BOUND = 2  # the search failed high, the real score is at least the stored one
+UPPER_BOUND = 3  # the search failed low, the real score is at most the stored one
+
+
+class SearchAborted(Exception):
+    # raised inside the search when the time or node budget runs out
+    pass
 
 
-def find_best_move(gamestate, valid_moves, zobrist_keys, transposition_table, print_usage):
-    global next_move, transposition_table_hits
+class SearchStats:
+    # what a search did: find_best_move fills it in after every iteration and returns it with the move
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+        self.nodes = self.qnodes = 0  # nodes include the quiescence nodes
+        self.depth = self.seldepth = 0  # the depth of the last completed iteration and the deepest ply searched
+        self.tt_probes = self.tt_hits = self.tt_cutoffs = 0
+        self.beta_cutoffs = self.first_move_cutoffs = 0
+        self.iteration_seconds = []  # time and nodes of every completed iteration
+        self.iteration_nodes = []
+        self.best_move = None
+        self.score = None
+        self.helper_nodes = 0  # nodes of the helper processes of lazy SMP, counted when they stop
+        self.hashfull = 0  # permille of the transposition table in use when the search ended
+        self.book = False
+        self.finished = False
+
+    def finish_iteration(self, depth, best_move, score):
+        copy_search_counters(self)
+        self.iteration_seconds.append(self.seconds - sum(self.iteration_seconds))
+        self.iteration_nodes.append(self.nodes - sum(self.iteration_nodes))
+        self.depth, self.best_move, self.score = depth, best_move, score
+
+    @property
+    def total_nodes(self):
+        return self.nodes + self.helper_nodes
+
+    @property
+    def nps(self):
+        return int(self.total_nodes / self.seconds) if self.seconds else 0
+
+    @property
+    def first_move_cutoff_rate(self):
+        return self.first_move_cutoffs / self.beta_cutoffs if self.beta_cutoffs else 0.0
+
+    @property
+    def branching_factor(self):
+        # effective branching factor, the nodes of the last iteration over the ones of the iteration before
+        if len(self.iteration_nodes) < 2 or not self.iteration_nodes[-2]:
+            return 0.0
+        return self.iteration_nodes[-1] / self.iteration_nodes[-2]
+
+
+root_depth = 0
+killer_moves = [[0, 0] for _ in range(MAX_PLY)]  # two quiet moves per ply that caused a beta cutoff
+history_scores = [[0] * 120 for _ in range(ChessEngine.OFFBOARD + 1)]  # piece code x end square
+beta_cutoffs = first_move_cutoffs = 0
+transposition_table_hits = 0  # transposition table entries that ended the search of a node
+nodes = qnodes = seldepth = tt_probes = tt_hits = 0
+helper_pool = None  # the processes of the lazy SMP search, started with the first search that needs them
+helper_pool_size = 0
+attached_tables = {}  # shared transposition tables a helper process has attached to, by their name
+
+
+def order_moves(gamestate, valid_moves, tt_move_id, ply):
+    squares = gamestate.squares
+    killers = killer_moves[ply] if ply < MAX_PLY else (0, 0)
+
+    def order(move):
+        if move.moveID == tt_move_id:
+            return TT_MOVE_ORDER
+        if move.is_capture or move.is_pawn_promotion:
+            # the move only knows the captured piece once it is made, an empty end square means en-passant
+            victim = ORDER_VALUES[squares[move.end_sq] & 7 or ChessEngine.PAWN] if move.is_capture else 0
+            promotion = ORDER_VALUES[move.promotion] if move.is_pawn_promotion else 0
+            return CAPTURE_ORDER + 16 * (victim + promotion) - ORDER_VALUES[move.moved & 7]
+        if move.moveID == killers[0]:
+            return KILLER_ORDER + 1
+        if move.moveID == killers[1]:
+            return KILLER_ORDER
+        return history_scores[move.moved][move.end_sq]
+
+    return sorted(valid_moves, key=order, reverse=True)
+
+
+def staged_moves(gamestate, tt_move_id, ply):
+    # yields the legal moves of a node in the order of order_moves, but every stage is only generated once the one
+    # before it is searched: the move of the transposition table, the captures and promotions, the killers and then
+    # the quiet moves. a cutoff in an early stage never generates the quiet moves. the game state is back at this
+    # node whenever the generator resumes, the moves searched in between leave it as they found it
+    if gamestate.inCheck():
+        # the ways out of a check are few, they are generated and ordered at once
+        yield from order_moves(gamestate, gamestate.generateMoves(), tt_move_id, ply)
+        return
+
+    searched = set()
+    if tt_move_id:
+        move = gamestate.getLegalMove(tt_move_id)
+        if move is not None:
+            searched.add(tt_move_id)
+            yield move
+
+    for move in order_moves(gamestate, gamestate.generateMoves(captures_only=True), 0, MAX_PLY):
+        if move.moveID not in searched:
+            searched.add(move.moveID)
+            yield move
+
+    if ply < MAX_PLY:
+        for killer in tuple(killer_moves[ply]):  # a cutoff below may change the killers of this ply
+            if killer and killer not in searched:
+                move = gamestate.getLegalMove(killer)
+                if move is not None:
+                    searched.add(killer)
+                    yield move
+
+    # the quiet moves come from a full generation, without the moves searched already
+    quiet_moves = [move for move in gamestate.generateMoves() if move.moveID not in searched]
+    yield from order_moves(gamestate, quiet_moves, 0, MAX_PLY)
+
+
+def update_move_ordering(move, depth, ply):
+    # remember a quiet move that caused a beta cutoff as killer of its ply and in the history table
+    if move.is_capture or move.is_pawn_promotion:
+        return
+    if ply < MAX_PLY and killer_moves[ply][0] != move.moveID:
+        killer_moves[ply][1] = killer_moves[ply][0]
+        killer_moves[ply][0] = move.moveID
+    history_scores[move.moved][move.end_sq] += depth * depth
+    if history_scores[move.moved][move.end_sq] >= KILLER_ORDER:
+        age_move_ordering()
+
+
+def perturb_move_ordering(rng):
+    # random history scores below the ones of real cutoffs, they change the order of the quiet moves without history
+    for scores in history_scores:
+        for sq in ChessEngine.SQUARES:
+            scores[sq] += rng.randrange(HISTORY_NOISE)
+
+
+def age_move_ordering():
+    # a new search starts two plies later, so the killers no longer fit and the history counts less
+    for killers in killer_moves:
+        killers[0] = killers[1] = 0
+    for scores in history_scores:
+        for sq in range(120):
+            scores[sq] //= 2
+
+
+def copy_search_counters(stats):
+    # the search counts in module globals like the rest of its state, they are copied into the stats it returns
+    stats.seconds = time.perf_counter() - stats.start
+    stats.nodes, stats.qnodes, stats.seldepth = nodes, qnodes, max(seldepth, root_depth)
+    stats.tt_probes, stats.tt_hits, stats.tt_cutoffs = tt_probes, tt_hits, transposition_table_hits
+    stats.beta_cutoffs, stats.first_move_cutoffs = beta_cutoffs, first_move_cutoffs
+
+
+def find_best_move(gamestate, valid_moves, transposition_table, print_usage, max_depth=DEPTH, time_limit=TIME_LIMIT,
+                   node_limit=NODE_LIMIT, stop=None, progress=None):
+    # returns the best move and the SearchStats of this search. stop is a threading.Event that aborts the search when
+    # set, progress is called with the stats after every completed iteration
+    global next_move, transposition_table_hits, beta_cutoffs, first_move_cutoffs, root_depth, nodes, qnodes, seldepth, \
+        tt_probes, tt_hits
     transposition_table_hits = 0
+    beta_cutoffs = first_move_cutoffs = 0
     next_move = None
-
-    if cfg["ai"]["version"] == "v4":
-        score = find_move_v4(gamestate, valid_moves, DEPTH, -CHECKMATE, CHECKMATE, 1 if gamestate.white_to_move else -1, zobrist_keys, transposition_table)
+    stats = SearchStats()
+
+    # the opening moves come from the book while it has one for the position
+    if opening_book is not None and len(gamestate.move_log) < BOOK_MAX_PLY:
+        next_move = opening_book.find_move(gamestate, valid_moves, BOOK_SELECTION)
+        if next_move is not None:
+            stats.best_move = next_move
+            stats.book = True
+            stats.finished = True
+            if print_usage:
+                print(f"Played {next_move} from the opening book.")
+            return next_move, stats
+
+    transposition_table.new_search()
+    age_move_ordering()
+
+    if cfg["ai"]["version"] in ("v4", "v5"):
+        # with more than one thread, helper processes search the same position at the same time and share their
+        # results through the transposition table (lazy SMP)
+        helpers = start_helper_searches(gamestate, transposition_table, max_depth, time_limit, node_limit) \
+            if THREADS > 1 and transposition_table.shared_memory is not None else None
+        best_move, score, depth = search_iteratively(gamestate, valid_moves, transposition_table, print_usage, max_depth,
+                                                     time_limit, node_limit, stats, stop, progress)
+        if helpers is not None:
+            best_move, score, depth = finish_helper_searches(helpers, transposition_table, valid_moves, best_move, score,
+                                                             depth, stats, print_usage)
+
+        next_move = best_move
+        copy_search_counters(stats)
+        stats.best_move, stats.score = best_move, score
+        stats.hashfull = transposition_table.hashfull()
         if print_usage:
             print(f"Used the transposition table for this move {transposition_table_hits} time(s).")
-            print(f"The transposition table now contains {len(transposition_table)} different board states.")
+            if beta_cutoffs:
+                print(f"{first_move_cutoffs / beta_cutoffs:.0%} of the {beta_cutoffs} beta cutoffs came from the first move.")
+            print(f"The transposition table is now {stats.hashfull / 10}% full.")
             print(f"The score of the move {next_move} was {score}")
     elif cfg["ai"]["version"] == "v3":
-        find_move_v3(gamestate, valid_moves, DEPTH, -CHECKMATE, CHECKMATE, 1 if gamestate.white_to_move else -1)
+        # the plain alpha-beta search has no time or node budget, only the depth
+        root_depth = max_depth
+        nodes = qnodes = seldepth = tt_probes = tt_hits = 0
+        score = find_move_v3(gamestate, valid_moves, max_depth, -CHECKMATE, CHECKMATE,
+                             1 if gamestate.white_to_move else -1)
+        stats.finish_iteration(max_depth, next_move, score)
+        if progress is not None:
+            progress(stats)
+        if print_usage:
+            print(f"The score of the move {next_move} was {score}")
     elif cfg["ai"]["version"] == "v2":
         # greedy alg.
         pass
     elif cfg["ai"]["version"] == "v1":
         find_random_move(valid_moves)
 
-    return next_move
+    stats.best_move = next_move
+    stats.finished = True
+    return next_move, stats
+
+
+def search_iteratively(gamestate, valid_moves, transposition_table, print_usage, max_depth, time_limit, node_limit,
+                       stats, stop=None, progress=None, first_depth=1):
+    # iterative deepening: search depth 1, 2, ... until max_depth or until the budget runs out. every iteration
+    # fills the transposition table for the next one and the best move found so far is searched first.
+    # returns the best move and score of the deepest completed iteration and its depth
+    global next_move, nodes, qnodes, seldepth, tt_probes, tt_hits, deadline, node_budget, root_depth, score_leaf, \
+        stop_event
+    # v5 searches like v4 but scores the leaves with the rewritten evaluator
+    score_leaf = score_board_v5 if cfg["ai"]["version"] == "v5" else score_board_v4
+    nodes = qnodes = seldepth = tt_probes = tt_hits = 0
+    deadline = time.perf_counter() + time_limit if time_limit else None
+    node_budget = node_limit
+    stop_event = stop
+    root_ply = len(gamestate.move_log)
+    best_move = None
+    score = None
+    completed_depth = 0
+
+    for depth in range(first_depth, max_depth + 1):
+        root_depth = depth
+        next_move = None
+        valid_moves = order_moves(gamestate, valid_moves, best_move.moveID if best_move is not None else 0, 0)
+        try:
+            iteration_score = find_move_v4(gamestate, valid_moves, depth, -CHECKMATE, CHECKMATE, 1 if gamestate.white_to_move else -1, transposition_table)
+        except SearchAborted:
+            # take back the moves of the unfinished iteration and keep the result of the last completed one
+            while len(gamestate.move_log) > root_ply:
+                gamestate.undoMove()
+            if best_move is None:
+                best_move = next_move
+            break
+
+        completed_depth = depth
+        if next_move is not None:
+            best_move, score = next_move, iteration_score
+        stats.finish_iteration(depth, best_move, score)
+        if print_usage:
+            print(f"Depth {depth}: {next_move} with a score of {iteration_score} after {nodes} nodes.")
+        if progress is not None:
+            progress(stats)
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+        if abs(iteration_score) >= MATE_BOUND and CHECKMATE - abs(iteration_score) <= depth:
+            break  # the mate is inside the searched depth, a deeper search can not find a faster one
+
+    return best_move, score, completed_depth
+
+
+def start_helper_searches(gamestate, transposition_table, max_depth, time_limit, node_limit):
+    # the helpers get the position with its history and search it until they are done or the main search stops them
+    global helper_pool, helper_pool_size
+    if helper_pool is None or helper_pool_size != THREADS - 1:
+        if helper_pool is not None:
+            helper_pool.shutdown()
+        # spawned processes start clean, so a search started from the worker thread of the UI is safe as well
+        helper_pool_size = THREADS - 1
+        helper_pool = ProcessPoolExecutor(helper_pool_size, mp_context=multiprocessing.get_context("spawn"))
+    transposition_table.stop_flag.clear()
+    return [helper_pool.submit(helper_search, transposition_table.shared_memory.name, transposition_table.size_mb,
+                               transposition_table.age, gamestate, index, max_depth, time_limit, node_limit)
+            for index in range(1, THREADS)]
+
+
+def finish_helper_searches(helpers, transposition_table, valid_moves, best_move, score, depth, stats, print_usage):
+    # stops the helpers and keeps the result of the deepest completed search, the main search wins a tie.
+    # the nodes of the helpers are added to the stats
+    transposition_table.stop_flag.set()
+    for helper in helpers:
+        helper_depth, move_id, helper_score, helper_nodes = helper.result()
+        stats.helper_nodes += helper_nodes
+        if print_usage:
+            print(f"Helper searched to depth {helper_depth} in {helper_nodes} nodes.")
+        helper_move = next((move for move in valid_moves if move.moveID == move_id), None)
+        if helper_depth > depth and helper_move is not None:
+            best_move, score, depth = helper_move, helper_score, helper_depth
+    return best_move, score, depth
+
+
+def helper_search(table_name, size_mb, age, gamestate, index, max_depth, time_limit, node_limit):
+    # runs in a helper process: odd helpers start one depth further and every helper orders its quiet moves with its
+    # own noise in the history, so they spread over different parts of the tree instead of repeating the main search
+    transposition_table = attached_tables.get(table_name)
+    if transposition_table is None:
+        transposition_table = attached_tables[table_name] = TranspositionTable(size_mb, name=table_name)
+    transposition_table.age = age
+    age_move_ordering()
+    perturb_move_ordering(random.Random(index << 8 | age))
+    valid_moves = gamestate.getValidMoves()
+    best_move, score, depth = search_iteratively(gamestate, valid_moves, transposition_table, False, max_depth,
+                                                 time_limit, node_limit, SearchStats(), transposition_table.stop_flag,
+                                                 first_depth=min(1 + index % 2, max_depth))
+    return depth, best_move.moveID if best_move is not None else 0, score, nodes
+
+
+def principal_variation(gamestate, transposition_table, best_move, max_length):
+    # the best move followed by the best moves the transposition table stored for the positions after it
+    pv = []
+    move = best_move
+    while move is not None and len(pv) < max_length:
+        gamestate.makeMove(move)
+        pv.append(move)
+        entry = transposition_table.probe(gamestate.zobrist_key)
+        move_id = entry[3] if entry is not None else 0
+        move = next((move for move in gamestate.getValidMoves() if move.moveID == move_id), None) if move_id else None
+    for _ in pv:
+        gamestate.undoMove()
+    return pv
+
+
+def score_to_table(score, ply):
+    # the transposition table keeps the plies of a mate from the stored position, not from the root of the search
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
 
 
-def find_move_v4(gamestate, valid_moves, depth, alpha, beta, turn_multiplier, zobrist_keys, transposition_table):
-    global next_move, transposition_table_hits
+def score_from_table(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
 
-    zobrist_key = get_position_zobrist(gamestate.board, zobrist_keys)
-    transposition_table_entry = check_zobrist_position(zobrist_key, transposition_table)
 
-    if transposition_table_entry is not None and transposition_table_entry["depth"] >= depth:
-        transposition_table_hits += 1  # Increment the counter
-        return transposition_table_entry["score"]
+def search_budget_exceeded():
+    # the node budget is checked at every node, the clock and the stop flag only every 256 nodes
+    if node_budget and nodes > node_budget:
+        return True
+    if nodes & 255 == 0:
+        return (deadline is not None and time.perf_counter() >= deadline) or (
+                stop_event is not None and stop_event.is_set())
+    return False
+
+
+def find_move_v4(gamestate, valid_moves, depth, alpha, beta, turn_multiplier, transposition_table):
+    global next_move, transposition_table_hits, nodes, tt_probes, tt_hits, beta_cutoffs, first_move_cutoffs
+
+    nodes += 1
+    if search_budget_exceeded():
+        raise SearchAborted
+    ply = root_depth - depth
+
+    # a position that occurred before (in the game or the line searched) or fifty moves without a capture or pawn
+    # move is a draw, repeating it again can not be better. a checkmate on the fiftieth move still counts
+    if depth != root_depth and (gamestate.repetitionCount() or gamestate.halfmove_clock >= 100 and (
+            valid_moves or gamestate.getValidMoves())):
+        return STALEMATE
+
+    zobrist_key = gamestate.zobrist_key
+    transposition_table_entry = transposition_table.probe(zobrist_key)
+    tt_probes += 1
+
+    # a stored score can only be used as it is if it is exact or its bound already falls outside the window,
+    # and never at the root where the move itself is needed
+    tt_move_id = 0
+    if transposition_table_entry is not None:
+        tt_hits += 1
+        entry_depth, entry_flag, entry_score, tt_move_id = transposition_table_entry
+        entry_score = score_from_table(entry_score, ply)
+        if entry_depth >= depth and depth != root_depth and (entry_flag == EXACT or (
+                entry_flag == LOWER_BOUND and entry_score >= beta) or (entry_flag == UPPER_BOUND and entry_score <= alpha)):
+            transposition_table_hits += 1  # Increment the counter
+            return entry_score
+
+    # the bitbases know the result of the smallest endgames, below the root they end the search right away
+    if Bitbases.tables and gamestate.phase <= Bitbases.MAX_PHASE and depth != root_depth:
+        known = Bitbases.probe(gamestate)
+        if known is not None:
+            return turn_multiplier * score_bitbase(gamestate, known)
 
     if depth == 0:
-        return turn_multiplier * score_board_v4(gamestate)
+        if QUIESCENCE_DEPTH:
+            return quiescence_v4(gamestate, QUIESCENCE_DEPTH, alpha, beta, turn_multiplier)
+        if valid_moves is None:
+            gamestate.getValidMoves()  # the evaluators read checkmate and stalemate from the game state
+        if gamestate.checkmate:
+            return ply - CHECKMATE
+        return turn_multiplier * score_leaf(gamestate)
 
     max_score = -CHECKMATE
+    original_alpha = alpha
+    best_move = None
+    # the root moves are already ordered by find_best_move, below it the moves are generated stage by stage
+    moves = valid_moves if depth == root_depth else staged_moves(gamestate, tt_move_id, ply)
 
-    for move in valid_moves:
+    move_number = -1
+    for move_number, move in enumerate(moves):
 
         gamestate.makeMove(move)
 
-        # what to do if he didnt
-        next_moves = gamestate.getValidMoves()
-        score = -find_move_v4(gamestate, next_moves, depth - 1, -beta, -alpha, -turn_multiplier, zobrist_keys, transposition_table)
+        # the moves of the child are only generated by its own search
+        score = -find_move_v4(gamestate, None, depth - 1, -beta, -alpha, -turn_multiplier, transposition_table)
 
         if score > max_score:
             max_score = score
-            if depth == DEPTH:
+            best_move = move
+            if depth == root_depth:
                 next_move = move
 
         gamestate.undoMove()
@@ -147,31 +501,112 @@ def find_move_v4(gamestate, valid_moves, depth, alpha, beta, turn_multiplier, zo
         if max_score > alpha:
             alpha = max_score
         if alpha >= beta:
+            beta_cutoffs += 1
+            if move_number == 0:
+                first_move_cutoffs += 1
+            update_move_ordering(move, depth, ply)
             break
 
-    add_zobrist_position(zobrist_key, transposition_table, max_score, alpha, beta, depth)
+    if move_number < 0:  # no legal move
+        return ply - CHECKMATE if gamestate.inCheck() else STALEMATE
+
+    if max_score <= original_alpha:
+        flag = UPPER_BOUND
+    elif max_score >= beta:
+        flag = LOWER_BOUND
+    else:
+        flag = EXACT
+    transposition_table.store(zobrist_key, depth, flag, score_to_table(max_score, ply),
+                              best_move.moveID if best_move is not None else 0)
+
+    return max_score
+
+
+def quiescence_v4(gamestate, depth, alpha, beta, turn_multiplier):
+    # play out the captures (and promotions) at the horizon, so the search does not stop in the middle of an exchange.
+    # the side to move may always stand pat on the static score instead, unless it is in check
+    global nodes, qnodes, seldepth
+
+    nodes += 1
+    qnodes += 1
+    ply = root_depth + QUIESCENCE_DEPTH - depth
+    if ply > seldepth:
+        seldepth = ply
+    if search_budget_exceeded():
+        raise SearchAborted
+
+    moves = gamestate.generateMoves(captures_only=True)
+    in_check = gamestate.in_check
+    if in_check and not moves:
+        return ply - CHECKMATE
+    # a stalemate is only looked for where the quiescence search starts, further on it only follows captures
+    if not moves and depth == QUIESCENCE_DEPTH and not gamestate.hasLegalMove():
+        return STALEMATE
+    if depth == 0:
+        return turn_multiplier * score_leaf(gamestate)
+
+    if in_check:
+        max_score = -CHECKMATE
+    else:
+        max_score = turn_multiplier * score_leaf(gamestate)  # stand pat
+        if max_score >= beta:
+            return max_score
+        # delta pruning: even winning a queen would not bring the score back up to alpha
+        if max_score + piece_values[ChessEngine.WHITE | ChessEngine.QUEEN] + DELTA_MARGIN < alpha:
+            return max_score
+        if max_score > alpha:
+            alpha = max_score
+
+    for move in order_moves(gamestate, moves, 0, MAX_PLY):
+        # delta pruning of a single capture that can not raise the score to alpha
+        if not in_check and not move.is_pawn_promotion and \
+                max_score + piece_values[gamestate.squares[move.end_sq] or ChessEngine.WHITE | ChessEngine.PAWN] + \
+                DELTA_MARGIN < alpha:
+            continue
+
+        gamestate.makeMove(move)
+        score = -quiescence_v4(gamestate, depth - 1, -beta, -alpha, -turn_multiplier)
+        gamestate.undoMove()
+
+        if score > max_score:
+            max_score = score
+        if max_score > alpha:
+            alpha = max_score
+        if alpha >= beta:
+            break
 
     return max_score
 
 
 def find_move_v3(gamestate, valid_moves, depth, alpha, beta, turn_multiplier):
-    global next_move
+    global next_move, nodes
 
+    nodes += 1
+    if gamestate.checkmate:
+        return root_depth - depth - CHECKMATE
     if depth == 0:
         return turn_multiplier * score_board_v3(gamestate)
+    if gamestate.stalemate:
+        return STALEMATE
 
     max_score = -CHECKMATE
+    leaf_scores = ChessNumpy.score_children(gamestate, valid_moves, POSITION_WEIGHT) \
+        if depth == 1 and NUMPY_EVAL else None
 
-    for move in valid_moves:
+    for i, move in enumerate(valid_moves):
 
         gamestate.makeMove(move)
 
         next_moves = gamestate.getValidMoves()
-        score = -find_move_v3(gamestate, next_moves, depth - 1, -beta, -alpha, -turn_multiplier)
+        if leaf_scores is not None and not gamestate.checkmate and not gamestate.stalemate:
+            nodes += 1  # the leaf the recursion would have counted
+            score = turn_multiplier * leaf_scores[i]
+        else:
+            score = -find_move_v3(gamestate, next_moves, depth - 1, -beta, -alpha, -turn_multiplier)
 
         if score > max_score:
             max_score = score
-            if depth == DEPTH:
+            if depth == root_depth:
                 next_move = move
 
         gamestate.undoMove()
@@ -185,7 +620,10 @@ def find_move_v3(gamestate, valid_moves, depth, alpha, beta, turn_multiplier):
 
 
 # positive score == white is winning, negative score == black is winning
-def score_board_v4(gamestate):
+def score_board_v5(gamestate):
+    # score_board_v4 with its terms corrected, so it scores differently: the repetition and castling terms count
+    # once instead of once per piece and go to the side that made the last move, only real castling moves score
+    # (v4 rewards any king move to c1, g1, c8 or g8) and the bitbases score the endgames they know
     if gamestate.checkmate:
         if gamestate.white_to_move:
             return -CHECKMATE
@@ -194,62 +632,29 @@ def score_board_v4(gamestate):
     elif gamestate.stalemate:
         return STALEMATE
 
-    score = 0
-
-    for row in range(len(gamestate.board)):
-        for col in range(len(gamestate.board[row])):
-            square = gamestate.board[row][col]
-            if square != "--":
-                color = square[0]
-                type = square[1]
-
-                if color == "w":
-                    piece_position_score = piece_position_scores["w" + type][row][col]
-                    in_check, pins, checks = gamestate.checkForPinsAndChecks()
-
-                    score += piece_value[square[1]] + piece_position_score * POSITION_WEIGHT
-
-                    if len(gamestate.move_log) > 3:
-                        if str(gamestate.move_log[-1]) == str(gamestate.move_log[-3]):
-                            score -= MOVE_REP_PUNISH
-                        if str(gamestate.move_log[-1]) == "Kc1":
-                            score += CASTLING_SCORE
-                        elif str(gamestate.move_log[-1]) == "Kg1":
-                            score += CASTLING_SCORE
+    if Bitbases.tables and gamestate.phase <= Bitbases.MAX_PHASE:
+        known = Bitbases.probe(gamestate)
+        if known is not None:
+            return score_bitbase(gamestate, known)
 
-                    """if in_check:
-                        score -= cfg["ai"]["check_punish"]
+    score = score_material_and_position(gamestate)
 
-                    if (len(pins) and len(checks)) > 0:
-                        for punish in range(len(pins)):
-                            score -= punish + 1
-
-                        for punish in range(len(checks)):
-                            score -= punish + 2"""
-
-                elif color == "b":
-                    piece_position_score = piece_position_scores["b" + type][row][col]
-
-                    score -= piece_value[square[1]] + piece_position_score * POSITION_WEIGHT
-
-                    if len(gamestate.move_log) > 3:
-                        if str(gamestate.move_log[-1]) == str(gamestate.move_log[-3]):
-                            score += MOVE_REP_PUNISH
-                        if str(gamestate.move_log[-1]) == "Kg8":
-                            score -= CASTLING_SCORE
-                        elif str(gamestate.move_log[-1]) == "Kc8":
-                            score -= CASTLING_SCORE
-
-                if gamestate.move_log[-1] == ("Kc1" or "Kg1" or "Kc8" or "Kg8" or "0-0" or "0-0-0"):
-                    print("Found King Castle Move")
-                    with open("king_moves.txt", "a") as file:
-                        file.write(f"King Move {gamestate.move_log[-1]} had a score of {score}\n")
+    move_log = gamestate.move_log
+    if len(move_log) > 3:
+        last_move = move_log[-1]
+        side = -1 if gamestate.white_to_move else 1  # the side that made the last move
+        if last_move.moveID == move_log[-3].moveID:  # the same move as the last time, going back and forth
+            score -= side * MOVE_REP_PUNISH
+        if last_move.is_castle_move:
+            score += side * CASTLING_SCORE
 
     return score
 
 
 # positive score == white is winning, negative score == black is winning
-def score_board_v3(gamestate):
+def score_board_v4(gamestate):
+    # the repetition and king move terms count once for every piece of the side they belong to, the pieces are only
+    # counted when one of the terms applies. a king move is matched by its name, so castling ("0-0") never scores
     if gamestate.checkmate:
         if gamestate.white_to_move:
             return -CHECKMATE
@@ -258,60 +663,207 @@ def score_board_v3(gamestate):
     elif gamestate.stalemate:
         return STALEMATE
 
-    score = 0
-
-    for row in range(len(gamestate.board)):
-        for col in range(len(gamestate.board[row])):
-            square = gamestate.board[row][col]
-            if square != "--":
-                color = square[0]
-                type = square[1]
-
-                if color == "w":
-                    piece_position_score = piece_position_scores["w" + type][row][col]
-                    score += piece_value[square[1]] + piece_position_score * POSITION_WEIGHT
-
-                elif color == "b":
-                    piece_position_score = piece_position_scores["b" + type][row][col]
-                    score -= piece_value[square[1]] + piece_position_score * POSITION_WEIGHT
+    score = score_material_and_position(gamestate)
+    move_log = gamestate.move_log
+    if len(move_log) > 3:
+        # the same move as two plies ago, going back and forth
+        repeated = move_log[-1].moveID == move_log[-3].moveID
+        last_move = str(move_log[-1])
+        white_castled = last_move in ("Kc1", "Kg1")
+        black_castled = last_move in ("Kg8", "Kc8")
+        if repeated or white_castled or black_castled:
+            squares = gamestate.squares
+            white_pieces = black_pieces = 0
+            for sq in ChessEngine.SQUARES:
+                piece = squares[sq]
+                if piece & ChessEngine.WHITE:
+                    white_pieces += 1
+                elif piece & ChessEngine.BLACK:
+                    black_pieces += 1
+            if repeated:
+                score += (black_pieces - white_pieces) * MOVE_REP_PUNISH
+            if white_castled:
+                score += white_pieces * CASTLING_SCORE
+            if black_castled:
+                score -= black_pieces * CASTLING_SCORE
 
     return score
 
 
-def generate_zobrist_keys():
-    zobrist_keys = {}
-
-    for row in range(8):
-        for col in range(8):
-            piece_zobrist_keys = {piece: random.getrandbits(64) for piece in pieces}
-            zobrist_keys[(row, col)] = piece_zobrist_keys
-
-    return zobrist_keys
-
-
-def get_position_zobrist(board, zobrist_keys):
-    key = 0
-
-    for row in range(8):
-        for col in range(8):
-            piece = board[row][col]
-            if piece != "--":
-                key ^= zobrist_keys[(row, col)][piece]
-
-    return key
+# positive score == white is winning, negative score == black is winning
+def score_board_v3(gamestate):
+    if gamestate.checkmate:
+        if gamestate.white_to_move:
+            return -CHECKMATE
+        else:
+            return CHECKMATE
+    elif gamestate.stalemate:
+        return STALEMATE
 
+    return score_material_and_position(gamestate)
 
-def check_zobrist_position(zobrist_key, transposition_table):
-    try:
-        transposition_table_entry = transposition_table[zobrist_key]
-        return transposition_table_entry
 
-    except KeyError:
+def score_bitbase(gamestate, known):
+    # the score of a position the bitbases know, from the result and plies to mate of Bitbases.probe.
+    # KPK has no distances, its wins score the progress of the pawn instead
+    result, plies = known
+    if result == 0:
+        return STALEMATE
+    side = 1 if gamestate.white_to_move else -1
+    if plies is None:
+        return side * result * (BITBASE_WIN + Bitbases.pawn_progress(gamestate))
+    return side * result * (BITBASE_WIN + MAX_PLY - plies)
+
+
+def score_material_and_position(gamestate):
+    # material plus the piece-square scores, read from the sums the game state keeps up to date. the king table is
+    # tapered from the middle game one to the end game one as the pieces come off the board
+    phase = min(gamestate.phase, ChessEngine.MAX_PHASE)
+    position = (gamestate.midgame_position * phase + gamestate.endgame_position * (ChessEngine.MAX_PHASE - phase)) / \
+        ChessEngine.MAX_PHASE
+    return gamestate.material + position * POSITION_WEIGHT
+
+
+class SearchWorker:
+    # runs find_best_move in a background thread, so the pygame loop keeps drawing while the engine thinks.
+    # requests go in through search(), results come out through poll() as (kind, move, stats)
+    def __init__(self, transposition_table, print_usage=False):
+        self.transposition_table = transposition_table
+        self.print_usage = print_usage
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.generation = 0  # cancel() moves it on, requests and results of older generations are dropped
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def search(self, gamestate, kind="move", progress=None, **limits):
+        # the worker searches its own copy, the caller may keep making and taking back moves on gamestate.
+        # kind is handed back with the result, "ponder" searches only fill the transposition table
+        self.requests.put((self.generation, kind, copy.deepcopy(gamestate), progress, limits))
+
+    def cancel(self):
+        # drops every pending request and aborts the running search
+        self.generation += 1
+        self.stop.set()
+
+    def poll(self):
+        # the next result of the current generation, None while there is none
+        while True:
+            try:
+                generation, kind, move, stats = self.results.get_nowait()
+            except queue.Empty:
+                return None
+            if generation == self.generation:
+                return kind, move, stats
+
+    def run(self):
+        while True:
+            generation, kind, gamestate, progress, limits = self.requests.get()
+            if generation != self.generation:
+                continue
+            self.stop.clear()
+            if generation != self.generation:  # cancelled while the flag was cleared
+                continue
+            move, stats = find_best_move(gamestate, gamestate.getValidMoves(), self.transposition_table,
+                                         self.print_usage and kind == "move", stop=self.stop, progress=progress,
+                                         **limits)
+            self.results.put((generation, kind, move, stats))
+
+
+class SharedFlag:
+    # a stop flag in a byte of shared memory, works like a threading.Event for the search
+    def __init__(self, flag):
+        self.flag = flag
+
+    def is_set(self):
+        return self.flag[0] != 0
+
+    def set(self):
+        self.flag[0] = 1
+
+    def clear(self):
+        self.flag[0] = 0
+
+
+class TranspositionTable:
+    # a fixed size hash table packed into preallocated 64-bit words, so its memory stays flat over a whole game.
+    # every bucket holds two entries: the first one keeps the deepest search of the current age, the second one
+    # is always replaced. an entry is the two words (key ^ data, data), so a half-written or foreign entry never
+    # matches a key. data packs the best move (16 bits), depth (8), bound flag (2), age (6) and the score (32)
+    BUCKET_BYTES = 32
+    SCORE_SCALE = 1000  # scores are stored as integers in thousandths of a pawn
+
+    def __init__(self, size_mb, shared=THREADS > 1, name=None):
+        # a shared table lives in shared memory so the helper processes of the search can read and write it without
+        # locks, they attach to it by its name. the byte after the table tells them to stop
+        self.size_mb = size_mb
+        self.buckets = max(1, int(size_mb * 1024 * 1024) // self.BUCKET_BYTES)
+        self.shared_memory = None
+        if shared or name is not None:
+            size = self.buckets * self.BUCKET_BYTES + 8
+            self.shared_memory = shared_memory.SharedMemory(name, create=name is None, size=size)
+            buffer = self.shared_memory.buf
+            # pool processes leave without running atexit, they close the table with the finalizers of multiprocessing
+            multiprocessing.util.Finalize(self, self.close, exitpriority=0)
+            self.owner = name is None
+        else:
+            buffer = bytearray(self.buckets * self.BUCKET_BYTES + 8)
+        self.table = memoryview(buffer)[:self.buckets * self.BUCKET_BYTES].cast("Q")
+        self.stop_flag = SharedFlag(memoryview(buffer)[self.buckets * self.BUCKET_BYTES:])
+        self.age = 0
+
+    def close(self):
+        # the process that created the shared memory also frees it
+        if self.shared_memory is not None:
+            self.table.release()
+            self.stop_flag.flag.release()
+            self.shared_memory.close()
+            if self.owner:
+                self.shared_memory.unlink()
+            self.shared_memory = None
+
+    def new_search(self):
+        # entries of older searches are replaced first, but can still be used until then
+        self.age = (self.age + 1) & 63
+
+    def clear(self):
+        for i in range(len(self.table)):
+            self.table[i] = 0
+
+    def probe(self, key):
+        table = self.table
+        index = key % self.buckets * 4
+        for slot in (index, index + 2):
+            data = table[slot + 1]
+            if data and table[slot] ^ data == key:
+                return (data >> 16) & 255, (data >> 24) & 3, ((data >> 32) - (1 << 31)) / self.SCORE_SCALE, data & 0xFFFF
         return None
 
-
-def add_zobrist_position(zobrist_key, transposition_table, score, alpha, beta, depth):
-    transposition_table[zobrist_key] = {"depth": depth, "score": score, "alpha": alpha, "beta": beta}
+    def store(self, key, depth, flag, score, move_id):
+        table = self.table
+        index = key % self.buckets * 4
+        stored = table[index + 1]
+        if stored == 0 or table[index] ^ stored == key or (stored >> 26) & 63 != self.age or depth >= (stored >> 16) & 255:
+            slot = index
+        else:
+            slot = index + 2
+        if move_id == 0 and table[slot + 1] and table[slot] ^ table[slot + 1] == key:
+            move_id = table[slot + 1] & 0xFFFF  # keep the best move of a previous search of this position
+        data = move_id | min(depth, 255) << 16 | flag << 24 | self.age << 26 | \
+            (int(round(score * self.SCORE_SCALE)) + (1 << 31)) << 32
+        table[slot] = key ^ data
+        table[slot + 1] = data
+
+    def hashfull(self):
+        # permille of the entries in the first buckets that were written by the current search
+        used = 0
+        sample = min(self.buckets, 500) * 4
+        for slot in range(0, sample, 2):
+            data = self.table[slot + 1]
+            if data and (data >> 26) & 63 == self.age:
+                used += 1
+        return used * 2000 // sample
 
 
 def get_square_state(gamestate):
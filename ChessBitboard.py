@@ -0,0 +1,458 @@
+from ChessEngine import GameState, Move, SQUARES, EMPTY, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING, WHITE, BLACK, WKS, WQS, \
+    BKS, BQS, PROMOTIONS, MOVE_CAPTURE, MOVE_ENPASSANT, MOVE_CASTLE, MOVE_PROMOTION_SHIFT
+
+# bitboards number the squares like the string board: bit 0 is a8, bit 7 is h8 and bit 63 is h1,
+# so moving one row up (towards the 8th rank) is a shift right by 8
+BIT = tuple(1 << i for i in range(64))
+FULL = (1 << 64) - 1
+TO_MAILBOX = SQUARES
+TO_BIT = [-1] * 120
+for i, sq in enumerate(SQUARES):
+    TO_BIT[sq] = i
+TO_BIT = tuple(TO_BIT)
+
+
+def _on_board(row, col):
+    return 0 <= row <= 7 and 0 <= col <= 7
+
+
+def _jump_masks(offsets):
+    masks = []
+    for i in range(64):
+        mask = 0
+        for d_row, d_col in offsets:
+            if _on_board(i // 8 + d_row, i % 8 + d_col):
+                mask |= BIT[(i // 8 + d_row) * 8 + i % 8 + d_col]
+        masks.append(mask)
+    return tuple(masks)
+
+
+def _ray(i, d_row, d_col):
+    mask = 0
+    row, col = i // 8 + d_row, i % 8 + d_col
+    while _on_board(row, col):
+        mask |= BIT[row * 8 + col]
+        row, col = row + d_row, col + d_col
+    return mask
+
+
+KNIGHT_ATTACKS = _jump_masks(((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, 1), (2, -1), (1, -2), (-1, -2)))
+KING_ATTACKS = _jump_masks(((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+PAWN_ATTACKS = {WHITE: _jump_masks(((-1, -1), (-1, 1))), BLACK: _jump_masks(((1, -1), (1, 1)))}
+
+# every line through a square is split in the part above it (higher bits) and below it (lower bits),
+# rank and file for rooks, diagonal and anti-diagonal for bishops
+LINE_DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+UPPER = tuple(tuple(_ray(i, d_row, d_col) for i in range(64)) for d_row, d_col in LINE_DIRECTIONS)
+LOWER = tuple(tuple(_ray(i, -d_row, -d_col) for i in range(64)) for d_row, d_col in LINE_DIRECTIONS)
+LINE = tuple(tuple(UPPER[line][i] | LOWER[line][i] for i in range(64)) for line in range(4))
+ROOK_RAYS = tuple(LINE[0][i] | LINE[1][i] for i in range(64))
+BISHOP_RAYS = tuple(LINE[2][i] | LINE[3][i] for i in range(64))
+
+# squares strictly between two squares on the same line, 0 if they are not on a line
+BETWEEN = [[0] * 64 for _ in range(64)]
+for i in range(64):
+    for d_row, d_col in LINE_DIRECTIONS + tuple((-d_row, -d_col) for d_row, d_col in LINE_DIRECTIONS):
+        between = 0
+        row, col = i // 8 + d_row, i % 8 + d_col
+        while _on_board(row, col):
+            BETWEEN[i][row * 8 + col] = between
+            between |= BIT[row * 8 + col]
+            row, col = row + d_row, col + d_col
+BETWEEN = tuple(tuple(row) for row in BETWEEN)
+
+
+def line_attacks(i, occupied, line):
+    # obstruction difference: subtracting the nearest blocker below the square from the blockers above it
+    # flips exactly the bits up to the nearest blocker above, the same trick hyperbola quintessence uses
+    # but without having to bit-reverse the board
+    lower = LOWER[line][i] & occupied
+    upper = UPPER[line][i] & occupied
+    nearest_lower = 1 << ((lower | 1).bit_length() - 1)
+    return (upper ^ (upper - nearest_lower)) & LINE[line][i]
+
+
+def _line_table(line):
+    # the attacks along a line for every occupancy of its squares, looked up by the occupancy masked to the line.
+    # a square sees at most 7 others on a line, so all four tables together have about 21000 entries
+    table = []
+    for i in range(64):
+        mask = LINE[line][i]
+        attacks = {}
+        occupancy = 0
+        while True:  # every subset of the mask (Carry-Rippler)
+            attacks[occupancy] = line_attacks(i, occupancy, line)
+            occupancy = (occupancy - mask) & mask
+            if not occupancy:
+                break
+        table.append(attacks)
+    return tuple(table)
+
+
+RANK_ATTACKS, FILE_ATTACKS, DIAGONAL_ATTACKS, ANTI_DIAGONAL_ATTACKS = (_line_table(line) for line in range(4))
+RANK_MASK, FILE_MASK, DIAGONAL_MASK, ANTI_DIAGONAL_MASK = LINE
+
+
+def rook_attacks(i, occupied):
+    return RANK_ATTACKS[i][occupied & RANK_MASK[i]] | FILE_ATTACKS[i][occupied & FILE_MASK[i]]
+
+
+def bishop_attacks(i, occupied):
+    return DIAGONAL_ATTACKS[i][occupied & DIAGONAL_MASK[i]] | ANTI_DIAGONAL_ATTACKS[i][occupied & ANTI_DIAGONAL_MASK[i]]
+
+
+SLIDER_ATTACKS = ((BISHOP, bishop_attacks), (ROOK, rook_attacks))
+
+
+def bits(bitboard):
+    # yields the index of every set bit, lowest first
+    while bitboard:
+        lowest = bitboard & -bitboard
+        yield lowest.bit_length() - 1
+        bitboard ^= lowest
+
+
+_new_move = Move.__new__
+
+
+def new_move(moved, data):
+    # a Move from its packed data, the generators below know the piece and the flags without looking at the board
+    move = _new_move(Move)
+    move.moved = moved
+    move.data = data
+    move.captured = EMPTY
+    return move
+
+
+class BitboardGameState(GameState):
+    # keeps one bitboard per piece next to the compact board and generates the legal moves with set operations,
+    # the compact board stays the source of truth for the evaluators and the UI. the unused piece codes WHITE and
+    # BLACK hold the occupancy of each color. loops over the set bits are written out, they run at every node
+    def __init__(self, fen=None):
+        super().__init__(fen)
+        self.bitboards = [0] * (BLACK | KING + 1)  # indexed by piece code, 12 of them plus the 2 colors are used
+        for i in range(64):
+            piece = self.squares[TO_MAILBOX[i]]
+            if piece != EMPTY:
+                self.bitboards[piece] |= BIT[i]
+                self.bitboards[piece & (WHITE | BLACK)] |= BIT[i]
+
+    def makeMove(self, move):
+        super().makeMove(move)
+        self.toggleMove(move)
+
+    def undoMove(self):
+        if len(self.move_log) != 0:
+            self.toggleMove(self.move_log[-1])
+            super().undoMove()
+
+    def toggleMove(self, move):
+        # puts the changes of a move into the bitboards with XOR, toggling them once more takes the move back
+        bitboards = self.bitboards
+        data = move.data
+        start, end = data & 63, data >> 6 & 63  # the packed move numbers its squares like the bitboards
+        moved = move.moved
+        color = moved & (WHITE | BLACK)
+        start_bit, end_bit = BIT[start], BIT[end]
+        bitboards[moved] ^= start_bit
+        promotion = data >> MOVE_PROMOTION_SHIFT & 7
+        bitboards[color | promotion if promotion else moved] ^= end_bit
+        bitboards[color] ^= start_bit | end_bit
+        captured = move.captured
+        if data & MOVE_ENPASSANT:
+            captured_bit = BIT[(start & ~7) | (end & 7)]
+            bitboards[captured] ^= captured_bit
+            bitboards[captured & (WHITE | BLACK)] ^= captured_bit
+        elif captured != EMPTY:
+            bitboards[captured] ^= end_bit
+            bitboards[captured & (WHITE | BLACK)] ^= end_bit
+        if data & MOVE_CASTLE:
+            if end - start == 2:  # king-side
+                rook_bits = BIT[end + 1] | BIT[end - 1]
+            else:  # queen-side
+                rook_bits = BIT[end - 2] | BIT[end + 1]
+            bitboards[color | ROOK] ^= rook_bits
+            bitboards[color] ^= rook_bits
+
+    def attackersTo(self, i, occupied, color):
+        # all pieces of the given color attacking square i, with sliders blocked by the occupied squares
+        bitboards = self.bitboards
+        queens = bitboards[color | QUEEN]
+        return (KNIGHT_ATTACKS[i] & bitboards[color | KNIGHT]) | (KING_ATTACKS[i] & bitboards[color | KING]) | (
+                PAWN_ATTACKS[color ^ (WHITE | BLACK)][i] & bitboards[color | PAWN]) | (
+                rook_attacks(i, occupied) & (bitboards[color | ROOK] | queens)) | (
+                bishop_attacks(i, occupied) & (bitboards[color | BISHOP] | queens))
+
+    def occupancy(self, color):
+        return self.bitboards[color]
+
+    def squareUnderAttack(self, sq):
+        enemy_color = BLACK if self.white_to_move else WHITE
+        occupied = self.bitboards[WHITE] | self.bitboards[BLACK]
+        return self.attackersTo(TO_BIT[sq], occupied, enemy_color) != 0
+
+    def inCheck(self):
+        return self.squareUnderAttack(self.white_king_sq if self.white_to_move else self.black_king_sq)
+
+    def pinnedPieces(self, king, occupied, allies, enemy_color):
+        # a piece alone between the king and an enemy slider may only move along that line: square -> allowed squares
+        bitboards = self.bitboards
+        pinned = {}
+        enemy_queens = bitboards[enemy_color | QUEEN]
+        snipers = (ROOK_RAYS[king] & (bitboards[enemy_color | ROOK] | enemy_queens)) | (
+                BISHOP_RAYS[king] & (bitboards[enemy_color | BISHOP] | enemy_queens))
+        while snipers:
+            sniper_bit = snipers & -snipers
+            snipers ^= sniper_bit
+            sniper = sniper_bit.bit_length() - 1
+            blockers = BETWEEN[king][sniper] & occupied
+            if blockers and not blockers & (blockers - 1) and blockers & allies:
+                pinned[blockers.bit_length() - 1] = BETWEEN[king][sniper] | sniper_bit
+        return pinned
+
+    def generateMoves(self, captures_only=False):
+        # with captures_only only captures and promotions are generated, unless the king is in check
+        moves = []
+        append = moves.append
+        bitboards = self.bitboards
+        if self.white_to_move:
+            ally_color, enemy_color = WHITE, BLACK
+            king = TO_BIT[self.white_king_sq]
+            push = -8
+        else:
+            ally_color, enemy_color = BLACK, WHITE
+            king = TO_BIT[self.black_king_sq]
+            push = 8
+        allies = bitboards[ally_color]
+        enemies = bitboards[enemy_color]
+        occupied = allies | enemies
+        attackers_to = self.attackersTo
+
+        checkers = attackers_to(king, occupied, enemy_color)
+        self.in_check = checkers != 0
+        captures_only = captures_only and not checkers
+
+        # king moves, with the king taken off the board so sliders see through the square it leaves
+        piece = ally_color | KING
+        without_king = occupied ^ BIT[king]
+        ends = KING_ATTACKS[king] & (enemies if captures_only else ~allies)
+        while ends:
+            end_bit = ends & -ends
+            ends ^= end_bit
+            end = end_bit.bit_length() - 1
+            if not attackers_to(end, without_king, enemy_color):
+                append(new_move(piece, king | end << 6 | (MOVE_CAPTURE if enemies & end_bit else 0)))
+        if checkers & (checkers - 1):  # double check, king has to move
+            return moves
+
+        if checkers:  # capture the checking piece or block the line between it and the king
+            targets = (BETWEEN[king][checkers.bit_length() - 1] | checkers) & ~allies
+        elif captures_only:
+            targets = enemies
+        else:
+            targets = ~allies & FULL
+        pinned = self.pinnedPieces(king, occupied, allies, enemy_color)
+
+        piece = ally_color | KNIGHT
+        starts = bitboards[piece]
+        while starts:
+            start_bit = starts & -starts
+            starts ^= start_bit
+            start = start_bit.bit_length() - 1
+            if start in pinned:  # a pinned knight can never move
+                continue
+            ends = KNIGHT_ATTACKS[start] & targets
+            while ends:
+                end_bit = ends & -ends
+                ends ^= end_bit
+                append(new_move(piece, start | (end_bit.bit_length() - 1) << 6 | (
+                    MOVE_CAPTURE if enemies & end_bit else 0)))
+
+        for piece_type, attacks in SLIDER_ATTACKS:
+            for piece in (ally_color | piece_type, ally_color | QUEEN):
+                starts = bitboards[piece]
+                while starts:
+                    start_bit = starts & -starts
+                    starts ^= start_bit
+                    start = start_bit.bit_length() - 1
+                    ends = attacks(start, occupied) & targets & pinned.get(start, FULL)
+                    while ends:
+                        end_bit = ends & -ends
+                        ends ^= end_bit
+                        append(new_move(piece, start | (end_bit.bit_length() - 1) << 6 | (
+                            MOVE_CAPTURE if enemies & end_bit else 0)))
+
+        piece = ally_color | PAWN
+        pawn_attacks = PAWN_ATTACKS[ally_color]
+        start_row = 6 if ally_color == WHITE else 1
+        promotion_row = 1 if ally_color == WHITE else 6
+        promotions = PROMOTIONS[:1] if captures_only else PROMOTIONS
+        starts = bitboards[piece]
+        while starts:
+            start_bit = starts & -starts
+            starts ^= start_bit
+            start = start_bit.bit_length() - 1
+            allowed = targets & pinned.get(start, FULL)
+            end = start + push
+            if start >> 3 == promotion_row:
+                # every move of the pawn promotes, the push of a promotion counts as a capture
+                if captures_only:
+                    allowed = ~allies & FULL & pinned.get(start, FULL)
+                ends = pawn_attacks[start] & enemies & allowed
+                if not occupied & BIT[end] and allowed & BIT[end]:
+                    ends |= BIT[end]
+                while ends:
+                    end_bit = ends & -ends
+                    ends ^= end_bit
+                    data = start | (end_bit.bit_length() - 1) << 6 | (MOVE_CAPTURE if enemies & end_bit else 0)
+                    for promotion in promotions:
+                        append(new_move(piece, data | promotion << MOVE_PROMOTION_SHIFT))
+                continue
+            if not occupied & BIT[end]:  # 1 square pawn advance
+                if allowed & BIT[end]:
+                    append(new_move(piece, start | end << 6))
+                if start >> 3 == start_row and not occupied & BIT[end + push] and allowed & BIT[end + push]:
+                    append(new_move(piece, start | (end + push) << 6))
+            ends = pawn_attacks[start] & enemies & allowed
+            while ends:
+                end_bit = ends & -ends
+                ends ^= end_bit
+                append(new_move(piece, start | (end_bit.bit_length() - 1) << 6 | MOVE_CAPTURE))
+
+        if self.enpassant_square:
+            end = TO_BIT[self.enpassant_square]
+            captured = end - push
+            for start in bits(PAWN_ATTACKS[enemy_color][end] & bitboards[piece]):
+                # try the capture on the occupancy, both pawns leave their squares at once
+                after = occupied ^ BIT[start] ^ BIT[end] ^ BIT[captured]
+                if not attackers_to(king, after, enemy_color) & ~BIT[captured]:
+                    append(new_move(piece, start | end << 6 | MOVE_CAPTURE | MOVE_ENPASSANT))
+
+        if not checkers and not captures_only:
+            piece = ally_color | KING
+            if ally_color == WHITE:
+                kingside, queenside = self.castling_rights & WKS, self.castling_rights & WQS
+            else:
+                kingside, queenside = self.castling_rights & BKS, self.castling_rights & BQS
+            if kingside and not occupied & (BIT[king + 1] | BIT[king + 2]) and not attackers_to(
+                    king + 1, occupied, enemy_color) and not attackers_to(king + 2, occupied, enemy_color):
+                append(new_move(piece, king | (king + 2) << 6 | MOVE_CASTLE))
+            if queenside and not occupied & (BIT[king - 1] | BIT[king - 2] | BIT[king - 3]) and not attackers_to(
+                    king - 1, occupied, enemy_color) and not attackers_to(king - 2, occupied, enemy_color):
+                append(new_move(piece, king | (king - 2) << 6 | MOVE_CASTLE))
+
+        return moves
+
+    def hasLegalMove(self):
+        # bitboard version of GameState.hasLegalMove: the king steps and the pieces are tried one after the other
+        # until one of them can move, only en-passant is left to the full generation
+        bitboards = self.bitboards
+        if self.white_to_move:
+            ally_color, enemy_color = WHITE, BLACK
+            king = TO_BIT[self.white_king_sq]
+            push = -8
+        else:
+            ally_color, enemy_color = BLACK, WHITE
+            king = TO_BIT[self.black_king_sq]
+            push = 8
+        allies = bitboards[ally_color]
+        enemies = bitboards[enemy_color]
+        occupied = allies | enemies
+        without_king = occupied ^ BIT[king]
+        for end in bits(KING_ATTACKS[king] & ~allies):
+            if not self.attackersTo(end, without_king, enemy_color):
+                return True
+
+        targets = ~allies & FULL
+        pinned = self.pinnedPieces(king, occupied, allies, enemy_color)
+        for start in bits(bitboards[ally_color | KNIGHT]):
+            if start not in pinned and KNIGHT_ATTACKS[start] & targets:
+                return True
+        for piece_type, attacks in SLIDER_ATTACKS:
+            for start in bits(bitboards[ally_color | piece_type] | bitboards[ally_color | QUEEN]):
+                if attacks(start, occupied) & targets & pinned.get(start, FULL):
+                    return True
+        pawn_attacks = PAWN_ATTACKS[ally_color]
+        for start in bits(bitboards[ally_color | PAWN]):
+            allowed = pinned.get(start, FULL)
+            if (BIT[start + push] & ~occupied | pawn_attacks[start] & enemies) & allowed:
+                return True
+        return self.enpassant_square != 0 and len(self.generateMoves()) > 0
+
+    def getLegalMove(self, move_id):
+        # bitboard version of GameState.getLegalMove: the move is checked against the attacks of its piece and then
+        # tried on the occupancy, it must not leave the king attacked
+        start, end = move_id & 63, move_id >> 6 & 63
+        promotion = move_id >> MOVE_PROMOTION_SHIFT & 7
+        bitboards = self.bitboards
+        if self.white_to_move:
+            ally_color, enemy_color = WHITE, BLACK
+            king = TO_BIT[self.white_king_sq]
+            push = -8
+            start_row = 6
+        else:
+            ally_color, enemy_color = BLACK, WHITE
+            king = TO_BIT[self.black_king_sq]
+            push = 8
+            start_row = 1
+        allies = bitboards[ally_color]
+        enemies = bitboards[enemy_color]
+        occupied = allies | enemies
+        start_bit, end_bit = BIT[start], BIT[end]
+        if not allies & start_bit or allies & end_bit:
+            return None
+        moved = self.squares[TO_MAILBOX[start]]
+        piece_type = moved & 7
+        data = start | end << 6 | (MOVE_CAPTURE if enemies & end_bit else 0)
+        if promotion and (piece_type != PAWN or promotion not in PROMOTIONS):
+            return None
+
+        if piece_type == KING:
+            if end - start == 2 or end - start == -2:
+                # castling: the right, the empty squares and the squares the king passes must all be there
+                rights = (WKS if end > start else WQS) if ally_color == WHITE else (BKS if end > start else BQS)
+                step = 1 if end > start else -1
+                between = BIT[start + step] | BIT[end] | (BIT[end - 1] if step < 0 else 0)
+                if start != king or not self.castling_rights & rights or occupied & between or \
+                        self.attackersTo(king, occupied, enemy_color) or \
+                        self.attackersTo(start + step, occupied, enemy_color) or \
+                        self.attackersTo(end, occupied, enemy_color):
+                    return None
+                return new_move(moved, start | end << 6 | MOVE_CASTLE)
+            if not KING_ATTACKS[start] & end_bit or self.attackersTo(end, occupied ^ start_bit, enemy_color):
+                return None
+            return new_move(moved, data)
+
+        if piece_type == PAWN:
+            if (end < 8 or end >= 56) != (promotion != 0):
+                return None
+            if end == start + push:
+                if occupied & end_bit:
+                    return None
+            elif end == start + 2 * push:
+                if start >> 3 != start_row or occupied & (BIT[start + push] | end_bit):
+                    return None
+            elif not PAWN_ATTACKS[ally_color][start] & end_bit:
+                return None
+            elif not enemies & end_bit:
+                if not self.enpassant_square or end != TO_BIT[self.enpassant_square]:
+                    return None
+                captured_bit = BIT[end - push]
+                after = occupied ^ start_bit ^ end_bit ^ captured_bit
+                if self.attackersTo(king, after, enemy_color) & ~captured_bit:
+                    return None
+                return new_move(moved, data | MOVE_CAPTURE | MOVE_ENPASSANT)
+            data |= promotion << MOVE_PROMOTION_SHIFT
+        elif piece_type == KNIGHT:
+            if not KNIGHT_ATTACKS[start] & end_bit:
+                return None
+        else:
+            attacks = (bishop_attacks(start, occupied) if piece_type != ROOK else 0) | (
+                rook_attacks(start, occupied) if piece_type != BISHOP else 0)
+            if not attacks & end_bit:
+                return None
+
+        # a piece captured on the end square no longer attacks the king
+        if self.attackersTo(king, occupied ^ start_bit | end_bit, enemy_color) & ~end_bit:
+            return None
+        return new_move(moved, data)
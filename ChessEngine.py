@@ -1,10 +1,198 @@
-import os
-os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
-import pygame
+import random
+
+# the engine works on a compact board: a flat bytearray of 120 squares (a 10x12 mailbox) where the outer ring
+# of squares is filled with sentinels, so the generators never have to check if a square is on the board.
+# row 0 of the string board (the 8th rank) starts at index 21 and every row is 10 squares wide.
+EMPTY = 0
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = 1, 2, 3, 4, 5, 6
+WHITE = 8
+BLACK = 16
+OFFBOARD = 32
+
+PIECE_CODES = {"--": EMPTY,
+               "wp": WHITE | PAWN, "wN": WHITE | KNIGHT, "wB": WHITE | BISHOP,
+               "wR": WHITE | ROOK, "wQ": WHITE | QUEEN, "wK": WHITE | KING,
+               "bp": BLACK | PAWN, "bN": BLACK | KNIGHT, "bB": BLACK | BISHOP,
+               "bR": BLACK | ROOK, "bQ": BLACK | QUEEN, "bK": BLACK | KING}
+PIECE_NAMES = tuple(next((name for name, code in PIECE_CODES.items() if code == i), "--") for i in range(OFFBOARD + 1))
+
+# the 64 playable squares in the same order as the string board (a8, b8, ..., h1)
+SQUARES = tuple(21 + row * 10 + col for row in range(8) for col in range(8))
+SQ_ROW = tuple(sq // 10 - 2 for sq in range(120))
+SQ_COL = tuple(sq % 10 - 1 for sq in range(120))
+SQ_INDEX = tuple(SQ_ROW[sq] * 8 + SQ_COL[sq] if sq in SQUARES else -1 for sq in range(120))  # position in SQUARES
+
+ROOK_DIRECTIONS = (-10, -1, 10, 1)  # up, left, down, right
+BISHOP_DIRECTIONS = (-11, -9, 11, 9)  # up/left, up/right, down/right, down/left
+KING_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+KNIGHT_MOVES = (-21, -19, -8, 12, 21, 19, 8, -12)  # up/left up/right right/up right/down down/right down/left left/down left/up
+PROMOTIONS = (QUEEN, KNIGHT, ROOK, BISHOP)  # pieces a pawn can promote to, the queen first
+
+# a move is packed into one integer: start square (bits 0-5) and end square (bits 6-11) as index into SQUARES,
+# the piece type a pawn promotes to (bits 12-14, 0 for no promotion) and the flags above them.
+# the lower 15 bits identify the move, see Move.moveID
+MOVE_PROMOTION_SHIFT = 12
+MOVE_ID_MASK = (1 << 15) - 1
+MOVE_CAPTURE = 1 << 15
+MOVE_ENPASSANT = 1 << 16
+MOVE_CASTLE = 1 << 17
+
+# castling rights are kept as a bit mask, a move clears every right whose king or rook square it touches
+WKS, WQS, BKS, BQS = 1, 2, 4, 8
+CASTLE_MASK = [WKS | WQS | BKS | BQS] * 120
+CASTLE_MASK[95] &= ~(WKS | WQS)  # e1
+CASTLE_MASK[98] &= ~WKS  # h1
+CASTLE_MASK[91] &= ~WQS  # a1
+CASTLE_MASK[25] &= ~(BKS | BQS)  # e8
+CASTLE_MASK[28] &= ~BKS  # h8
+CASTLE_MASK[21] &= ~BQS  # a8
+CASTLE_MASK = tuple(CASTLE_MASK)
+
+# zobrist keys in flat tables: one key per piece code * 120 + square, one for black to move, one per castling
+# rights mask and one per en-passant square. the generator is seeded so every process hashes positions the same way
+_zobrist_random = random.Random(20231031)
+ZOBRIST_PIECES = tuple(_zobrist_random.getrandbits(64) if PIECE_NAMES[i // 120] != "--" and i % 120 in SQUARES else 0
+                       for i in range((OFFBOARD + 1) * 120))
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+ZOBRIST_CASTLING = tuple(_zobrist_random.getrandbits(64) if rights else 0 for rights in range(16))
+ZOBRIST_ENPASSANT = tuple(_zobrist_random.getrandbits(64) if sq in SQUARES else 0 for sq in range(120))
+
+# piece-square tables from white's point of view (row 0 is the 8th rank) and the material value of every piece
+knight_scores = [[-50, -40, -30, -30, -30, -30, -40, -50],
+                 [-40, -20, 0, 0, 0, 0, -20, -40],
+                 [-30, 0, 10, 15, 15, 10, 0, -30],
+                 [-30, 5, 15, 20, 20, 15, 5, -30],
+                 [-30, 0, 15, 20, 20, 15, 0, -30],
+                 [-30, 5, 10, 15, 15, 10, 5, -30],
+                 [-40, -20, 0, 5, 5, 0, -20, -40],
+                 [-50, -40, -30, -30, -30, -30, -40, -50]]
+
+bishop_scores = [[-20, -10, -10, -10, -10, -10, -10, -20],
+                 [-10, 0, 0, 0, 0, 0, 0, -10],
+                 [-10, 0, 5, 10, 10, 5, 0, -10],
+                 [-10, 5, 5, 10, 10, 5, 5, -10],
+                 [-10, 0, 10, 10, 10, 10, 0, -10],
+                 [-10, 10, 10, 10, 10, 10, 10, -10],
+                 [-10, 5, 0, 0, 0, 0, 5, -10],
+                 [-20, -10, -10, -10, -10, -10, -10, -20]]
+
+rook_scores = [[0, 0, 0, 0, 0, 0, 0, 0],
+               [5, 10, 10, 10, 10, 10, 10, 5],
+               [-5, 0, 0, 0, 0, 0, 0, -5],
+               [-5, 0, 0, 0, 0, 0, 0, -5],
+               [-5, 0, 0, 0, 0, 0, 0, -5],
+               [-5, 0, 0, 0, 0, 0, 0, -5],
+               [-5, 0, 0, 0, 0, 0, 0, -5],
+               [0, 0, 5, 5, 5, 5, 0, 0]]
+
+queen_scores = [[-20, -10, -10, -5, -5, -10, -10, -20],
+                [-10, 0, 0, 0, 0, 0, 0, -10],
+                [-10, 0, 5, 5, 5, 5, 0, -10],
+                [-5, 0, 5, 5, 5, 5, 0, -5],
+                [0, 0, 5, 5, 5, 5, 0, -5],
+                [-10, 5, 5, 5, 5, 5, 0, -10],
+                [-10, 0, 5, 0, 0, 0, 0, -10],
+                [-20, -10, -10, -5, -5, -10, -10, -20]]
+
+pawn_scores = [[0, 0, 0, 0, 0, 0, 0, 0],
+               [50, 50, 50, 50, 50, 50, 50, 50],
+               [10, 10, 20, 30, 30, 20, 10, 10],
+               [5, 5, 10, 25, 25, 10, 5, 5],
+               [0, 0, 0, 20, 20, 0, 0, 0],
+               [5, -5, -10, 0, 0, -10, -5, 5],
+               [5, 10, 10, -20, -20, 10, 10, 5],
+               [20, 20, 20, 20, 20, 20, 20, 20]]
+
+king_scores = [[-30, -40, -40, -50, -50, -40, -40, -30],
+               [-30, -40, -40, -50, -50, -40, -40, -30],
+               [-30, -40, -40, -50, -50, -40, -40, -30],
+               [-30, -40, -40, -50, -50, -40, -40, -30],
+               [-20, -30, -30, -40, -40, -30, -30, -20],
+               [-10, -20, -20, -20, -20, -20, -20, -10],
+               [20, 20, 0, 0, 0, 0, 20, 20],
+               [20, 30, 10, 0, 0, 10, 30, 20]]
+
+king_piece_square_table_end_game = [[-50, -40, -30, -20, -20, -30, -40, -50],
+                                    [-30, -20, -10, 0, 0, -10, -20, -30],
+                                    [-30, -10, 20, 30, 30, 20, -10, -30],
+                                    [-30, -10, 30, 40, 40, 30, -10, -30],
+                                    [-30, -10, 30, 40, 40, 30, -10, -30],
+                                    [-30, -10, 20, 30, 30, 20, -10, -30],
+                                    [-30, -30, 0, 0, 0, 0, -30, -30],
+                                    [-50, -30, -30, -30, -30, -30, -30, -50]]
+
+piece_position_scores = {"wN": knight_scores,
+                         "bN": knight_scores[::-1],
+                         "wB": bishop_scores,
+                         "bB": bishop_scores[::-1],
+                         "wQ": queen_scores,
+                         "bQ": queen_scores[::-1],
+                         "wR": rook_scores,
+                         "bR": rook_scores[::-1],
+                         "wp": pawn_scores,
+                         "bp": pawn_scores[::-1],
+                         "wK": king_scores,
+                         "bK": king_scores[::-1]}
+
+piece_value = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "p": 1}
+pieces = ["bB", "bK", "bN", "bp", "bQ", "bR", "wB", "wK", "wN", "wp", "wQ", "wR"]
+
+# the same tables flattened for the running sums of the game state: material and piece-square scores are signed
+# (white positive) and indexed by piece code * 120 + square like the zobrist keys. the king uses its own table in the
+# end game, the phase counts the pieces left on the board and blends the two, MAX_PHASE being the opening
+PHASE_VALUES = {"K": 0, "Q": 4, "R": 2, "B": 1, "N": 1, "p": 0}
+MAX_PHASE = 24
+PIECE_VALUES = [0] * (OFFBOARD + 1)
+MATERIAL_SCORES = [0] * (OFFBOARD + 1)
+PHASE_SCORES = [0] * (OFFBOARD + 1)
+MIDGAME_SCORES = [0] * ((OFFBOARD + 1) * 120)
+ENDGAME_SCORES = [0] * ((OFFBOARD + 1) * 120)
+for _piece in pieces:
+    _code = PIECE_CODES[_piece]
+    _sign = 1 if _piece[0] == "w" else -1
+    PIECE_VALUES[_code] = piece_value[_piece[1]]
+    MATERIAL_SCORES[_code] = _sign * piece_value[_piece[1]]
+    PHASE_SCORES[_code] = PHASE_VALUES[_piece[1]]
+    _endgame_table = piece_position_scores[_piece]
+    if _piece[1] == "K":
+        _endgame_table = king_piece_square_table_end_game if _sign == 1 else king_piece_square_table_end_game[::-1]
+    for _row in range(8):
+        for _col in range(8):
+            MIDGAME_SCORES[_code * 120 + 21 + _row * 10 + _col] = _sign * piece_position_scores[_piece][_row][_col]
+            ENDGAME_SCORES[_code * 120 + 21 + _row * 10 + _col] = _sign * _endgame_table[_row][_col]
+PIECE_VALUES = tuple(PIECE_VALUES)
+MATERIAL_SCORES = tuple(MATERIAL_SCORES)
+PHASE_SCORES = tuple(PHASE_SCORES)
+MIDGAME_SCORES = tuple(MIDGAME_SCORES)
+ENDGAME_SCORES = tuple(ENDGAME_SCORES)
+
+
+def square(row, col):
+    return 21 + row * 10 + col
+
+
+def append_pawn_move(moves, start_sq, end_sq, squares, captures_only=False):
+    # a pawn reaching the last row promotes, one move for every piece it can become
+    if SQ_ROW[end_sq] == 0 or SQ_ROW[end_sq] == 7:
+        for promotion in PROMOTIONS[:1] if captures_only else PROMOTIONS:
+            moves.append(Move(start_sq, end_sq, squares, promotion=promotion))
+    else:
+        moves.append(Move(start_sq, end_sq, squares))
+
+
+def new_game_state(fen=None, backend="mailbox"):
+    # the bitboard backend lives in its own module and is only imported when it is asked for
+    if backend == "bitboard":
+        import ChessBitboard
+        return ChessBitboard.BitboardGameState(fen)
+    return GameState(fen)
 
 
 class GameState:
     def __init__(self, fen=None):
+        self.squares = bytearray([OFFBOARD]) * 120
+        self._board = None  # the string view of the board is built lazily, see the board property
+
         if fen is None:
             self.board = [
                 ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
@@ -18,137 +206,230 @@ class GameState:
         else:
             self.board = self.fen_to_board(fen)
 
-        self.moveFunctions = {"p": self.getPawnMoves, "R": self.getRookMoves, "N": self.getKnightMoves,
-                              "B": self.getBishopMoves, "Q": self.getQueenMoves, "K": self.getKingMoves}
+        self.moveFunctions = {PAWN: self.getPawnMoves, ROOK: self.getRookMoves, KNIGHT: self.getKnightMoves,
+                              BISHOP: self.getBishopMoves, QUEEN: self.getQueenMoves, KING: self.getKingMoves}
         self.white_to_move = True
         self.move_log = []
-        self.white_king_location = (7, 4)
-        self.black_king_location = (0, 4)
         self.checkmate = False
         self.stalemate = False
         self.rep_stalemate = False
         self.move_draw = False
         self.ins_draw = False
         self.in_check = False
-        self.pins = []
-        self.checks = []
-        self.enpassant_possible = ()  # coordinates for the square where en-passant capture is possible
-        self.enpassant_possible_log = [self.enpassant_possible]
-        self.current_castling_rights = CastleRights(True, True, True, True)
-        self.castle_rights_log = [CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                               self.current_castling_rights.wqs, self.current_castling_rights.bqs)]
+        self.pins = {}  # square of a pinned piece -> direction it is pinned from
+        self.checks = []  # (square, direction) of every piece giving check
+        self.captures_only = False  # piece generators skip the quiet moves, see generateMoves
+        self.enpassant_square = 0  # square where en-passant capture is possible, 0 when there is none
+        self.castling_rights = WKS | WQS | BKS | BQS
         self.fullmove_number = 0
         self.halfmove_clock = 0
-        self.castling_availability = "KQkq"
-
-        self.SOUNDS = {}
-        sounds = ["capture", "castle", "game-end", "game-start", "illegal", "move-check", "move-normal", "promote", "tenseconds"]
 
-        for sound in sounds:
-            self.SOUNDS[sound] = pygame.mixer.Sound(os.path.join("sounds", f"{sound}.mp3"))
+        if fen is not None:
+            self.load_fen_state(fen)
+
+        self.enpassant_log = [self.enpassant_square]
+        self.castle_rights_log = [self.castling_rights]
+        self.zobrist_key = self.computeZobristKey()
+        self.zobrist_log = [self.zobrist_key]
+        self.clock_log = []  # halfmove clock and fullmove number before every move, for undoMove
+        # running evaluation sums, see MIDGAME_SCORES. makeMove updates them, undoMove takes them back from the log
+        self.material, self.midgame_position, self.endgame_position, self.phase = self.computeEvaluation()
+        self.evaluation_log = []
+
+    @property
+    def board(self):
+        # the list of 8 rows of strings like "wN" and "--" is only needed by the UI and the FEN code,
+        # so it is rebuilt from the compact board the first time it is asked for after a move
+        if self._board is None:
+            squares = self.squares
+            self._board = [[PIECE_NAMES[squares[21 + row * 10 + col]] for col in range(8)] for row in range(8)]
+        return self._board
+
+    @board.setter
+    def board(self, board):
+        for row in range(8):
+            for col in range(8):
+                piece = PIECE_CODES[board[row][col]]
+                self.squares[square(row, col)] = piece
+                if piece == WHITE | KING:
+                    self.white_king_sq = square(row, col)
+                elif piece == BLACK | KING:
+                    self.black_king_sq = square(row, col)
+        self._board = None
+
+    @property
+    def white_king_location(self):
+        return SQ_ROW[self.white_king_sq], SQ_COL[self.white_king_sq]
+
+    @property
+    def black_king_location(self):
+        return SQ_ROW[self.black_king_sq], SQ_COL[self.black_king_sq]
+
+    @property
+    def enpassant_possible(self):
+        # coordinates for the square where en-passant capture is possible
+        if self.enpassant_square == 0:
+            return ()
+        return SQ_ROW[self.enpassant_square], SQ_COL[self.enpassant_square]
+
+    @property
+    def current_castling_rights(self):
+        rights = self.castling_rights
+        return CastleRights(bool(rights & WKS), bool(rights & BKS), bool(rights & WQS), bool(rights & BQS))
+
+    @property
+    def castling_availability(self):
+        rights = self.castling_rights
+        return ('K' if rights & WKS else '') + ('Q' if rights & WQS else '') + ('k' if rights & BKS else '') + ('q' if rights & BQS else '')
+
+    def computeZobristKey(self):
+        # full key of the position, makeMove keeps it up to date without rescanning the board
+        key = 0
+        for sq in SQUARES:
+            key ^= ZOBRIST_PIECES[self.squares[sq] * 120 + sq]
+        if not self.white_to_move:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        return key ^ ZOBRIST_CASTLING[self.castling_rights] ^ ZOBRIST_ENPASSANT[self.enpassant_square]
+
+    def computeEvaluation(self):
+        # full material, piece-square and phase sums of the position
+        material = midgame_position = endgame_position = phase = 0
+        for sq in SQUARES:
+            piece = self.squares[sq]
+            material += MATERIAL_SCORES[piece]
+            midgame_position += MIDGAME_SCORES[piece * 120 + sq]
+            endgame_position += ENDGAME_SCORES[piece * 120 + sq]
+            phase += PHASE_SCORES[piece]
+        return material, midgame_position, endgame_position, phase
 
     def makeMove(self, move):
-        self.board[move.start_row][move.start_col] = "--"
-        self.board[move.end_row][move.end_col] = move.piece_moved
+        squares = self.squares
+        data = move.data
+        start_sq, end_sq = SQUARES[data & 63], SQUARES[data >> 6 & 63]
+        moved = move.moved
+        # the captured piece is only known now, the move keeps it for undoMove and the UI
+        if data & MOVE_ENPASSANT:
+            captured_sq = start_sq - SQ_COL[start_sq] + SQ_COL[end_sq]  # the pawn next to the start square
+        else:
+            captured_sq = end_sq
+        move.captured = captured = squares[captured_sq]
+        # take the moved and captured piece, the castling rights and the en-passant square out of the key
+        key = self.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_PIECES[moved * 120 + start_sq] ^ \
+            ZOBRIST_PIECES[captured * 120 + captured_sq] ^ \
+            ZOBRIST_CASTLING[self.castling_rights] ^ ZOBRIST_ENPASSANT[self.enpassant_square]
+        squares[start_sq] = EMPTY
+        squares[captured_sq] = EMPTY  # capturing the pawn of an en-passant move
+        squares[end_sq] = moved
         self.move_log.append(move)  # log the move so we can undo it later
         self.white_to_move = not self.white_to_move  # switch players
+        self._board = None
         # update king's location if moved
-        if move.piece_moved == "wK":
-            self.white_king_location = (move.end_row, move.end_col)
-        elif move.piece_moved == "bK":
-            self.black_king_location = (move.end_row, move.end_col)
+        if moved == WHITE | KING:
+            self.white_king_sq = end_sq
+        elif moved == BLACK | KING:
+            self.black_king_sq = end_sq
+
+        self.evaluation_log.append((self.material, self.midgame_position, self.endgame_position, self.phase))
+        material = self.material - MATERIAL_SCORES[captured]
+        phase = self.phase - PHASE_SCORES[captured]
+        midgame_position = self.midgame_position - MIDGAME_SCORES[moved * 120 + start_sq] - \
+            MIDGAME_SCORES[captured * 120 + captured_sq]
+        endgame_position = self.endgame_position - ENDGAME_SCORES[moved * 120 + start_sq] - \
+            ENDGAME_SCORES[captured * 120 + captured_sq]
 
         # pawn promotion
-        if move.is_pawn_promotion:
-            # if not is_AI:
-            #    # promoted_piece = input("Promote to Q, R, B, or N:") #take this to UI later
-            #    # self.board[move.end_row][move.end_col] = move.piece_moved[0] + promoted_piece
-            # else:
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + "Q"
-
-        # enpassant move
-        if move.is_enpassant_move:
-            self.board[move.start_row][move.end_col] = "--"  # capturing the pawn
-
-        # update enpassant_possible variable
-        if move.piece_moved[1] == "p" and abs(move.start_row - move.end_row) == 2:  # only on 2 square pawn advance
-            self.enpassant_possible = ((move.start_row + move.end_row) // 2, move.start_col)
+        if data >> MOVE_PROMOTION_SHIFT & 7:
+            squares[end_sq] = promoted = (moved & (WHITE | BLACK)) | data >> MOVE_PROMOTION_SHIFT & 7
+            material += MATERIAL_SCORES[promoted] - MATERIAL_SCORES[moved]
+            phase += PHASE_SCORES[promoted]
+        midgame_position += MIDGAME_SCORES[squares[end_sq] * 120 + end_sq]
+        endgame_position += ENDGAME_SCORES[squares[end_sq] * 120 + end_sq]
+
+        # update enpassant_square variable
+        if moved & 7 == PAWN and abs(start_sq - end_sq) == 20:  # only on 2 square pawn advance
+            self.enpassant_square = (start_sq + end_sq) // 2
         else:
-            self.enpassant_possible = ()
+            self.enpassant_square = 0
 
         # castle move
-        if move.is_castle_move:
-            if move.end_col - move.start_col == 2:  # king-side castle move
-                self.board[move.end_row][move.end_col - 1] = self.board[move.end_row][
-                    move.end_col + 1]  # moves the rook to its new square
-                self.board[move.end_row][move.end_col + 1] = '--'  # erase old rook
+        if data & MOVE_CASTLE:
+            if end_sq - start_sq == 2:  # king-side castle move
+                rook_start, rook_end = end_sq + 1, end_sq - 1
             else:  # queen-side castle move
-                self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][
-                    move.end_col - 2]  # moves the rook to its new square
-                self.board[move.end_row][move.end_col - 2] = '--'  # erase old rook
-
-        self.enpassant_possible_log.append(self.enpassant_possible)
+                rook_start, rook_end = end_sq - 2, end_sq + 1
+            rook = squares[rook_start]
+            squares[rook_end] = rook  # moves the rook to its new square
+            squares[rook_start] = EMPTY  # erase old rook
+            key ^= ZOBRIST_PIECES[rook * 120 + rook_end] ^ ZOBRIST_PIECES[rook * 120 + rook_start]
+            midgame_position += MIDGAME_SCORES[rook * 120 + rook_end] - MIDGAME_SCORES[rook * 120 + rook_start]
+            endgame_position += ENDGAME_SCORES[rook * 120 + rook_end] - ENDGAME_SCORES[rook * 120 + rook_start]
+        self.material, self.midgame_position, self.endgame_position, self.phase = \
+            material, midgame_position, endgame_position, phase
+
+        self.enpassant_log.append(self.enpassant_square)
 
         # update castling rights - whenever it is a rook or king move
         self.updateCastleRights(move)
-        self.castle_rights_log.append(CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                                   self.current_castling_rights.wqs, self.current_castling_rights.bqs))
+        self.castle_rights_log.append(self.castling_rights)
+
+        # put the piece on its end square (a promoted pawn is hashed as the new piece), the new rights
+        # and the new en-passant square back into the key
+        self.zobrist_key = key ^ ZOBRIST_PIECES[squares[end_sq] * 120 + end_sq] ^ \
+            ZOBRIST_CASTLING[self.castling_rights] ^ ZOBRIST_ENPASSANT[self.enpassant_square]
+        self.zobrist_log.append(self.zobrist_key)
 
         # Update fullmove number and halfmove clock
+        self.clock_log.append((self.halfmove_clock, self.fullmove_number))
         if self.white_to_move:
             self.fullmove_number += 1
         self.halfmove_clock += 1
 
-        # Reset halfmove clock if a capture or pawn move occurs
-        if move.piece_captured or move.piece_moved[1] == 'p':
+        # Reset halfmove clock if a capture or pawn move occurs, the positions before it can not come back
+        if captured != EMPTY or moved & 7 == PAWN:
             self.halfmove_clock = 0
 
-        # Update the castling_availability string based on the current_castling_rights
-        self.castling_availability = ('K' if self.current_castling_rights.wks else '') + ('Q' if self.current_castling_rights.wqs else '') + ('k' if self.current_castling_rights.bks else '') + ('q' if self.current_castling_rights.bqs else '')
-
-        """if move.piece_captured != "--" and not move.is_pawn_promotion:
-            self.SOUNDS["capture"].play()
-        elif move.is_castle_move:
-            self.SOUNDS["castle"].play()
-        elif move.is_pawn_promotion:
-            self.SOUNDS["promote"].play()
-        elif self.inCheck():
-            self.SOUNDS["move-check"].play()
-        else:
-            self.SOUNDS["move-normal"].play()"""
-
     def undoMove(self):
         if len(self.move_log) != 0:  # make sure that there is a move to undo
             move = self.move_log.pop()
-            self.board[move.start_row][move.start_col] = move.piece_moved
-            self.board[move.end_row][move.end_col] = move.piece_captured
+            squares = self.squares
+            data = move.data
+            start_sq, end_sq = SQUARES[data & 63], SQUARES[data >> 6 & 63]
+            squares[start_sq] = move.moved
+            squares[end_sq] = move.captured
             self.white_to_move = not self.white_to_move  # swap players
+            self._board = None
             # update the king's position if needed
-            if move.piece_moved == "wK":
-                self.white_king_location = (move.start_row, move.start_col)
-            elif move.piece_moved == "bK":
-                self.black_king_location = (move.start_row, move.start_col)
+            if move.moved == WHITE | KING:
+                self.white_king_sq = start_sq
+            elif move.moved == BLACK | KING:
+                self.black_king_sq = start_sq
             # undo en passant move
-            if move.is_enpassant_move:
-                self.board[move.end_row][move.end_col] = "--"  # leave landing square blank
-                self.board[move.start_row][move.end_col] = move.piece_captured
+            if data & MOVE_ENPASSANT:
+                squares[end_sq] = EMPTY  # leave landing square blank
+                squares[start_sq - SQ_COL[start_sq] + SQ_COL[end_sq]] = move.captured
 
-            self.enpassant_possible_log.pop()
-            self.enpassant_possible = self.enpassant_possible_log[-1]
+            self.enpassant_log.pop()
+            self.enpassant_square = self.enpassant_log[-1]
 
             # undo castle rights
             self.castle_rights_log.pop()  # get rid of the new castle rights from the move we are undoing
-            self.current_castling_rights = self.castle_rights_log[-1]  # set the current castle rights to the last one in the list
+            self.castling_rights = self.castle_rights_log[-1]  # set the current castle rights to the last one in the list
+            self.zobrist_log.pop()
+            self.zobrist_key = self.zobrist_log[-1]
+            self.material, self.midgame_position, self.endgame_position, self.phase = self.evaluation_log.pop()
+            self.halfmove_clock, self.fullmove_number = self.clock_log.pop()
             # undo the castle move
-            if move.is_castle_move:
-                if move.end_col - move.start_col == 2:  # king-side
-                    self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][move.end_col - 1]
-                    self.board[move.end_row][move.end_col - 1] = '--'
+            if data & MOVE_CASTLE:
+                if end_sq - start_sq == 2:  # king-side
+                    squares[end_sq + 1] = squares[end_sq - 1]
+                    squares[end_sq - 1] = EMPTY
                 else:  # queen-side
-                    self.board[move.end_row][move.end_col - 2] = self.board[move.end_row][move.end_col + 1]
-                    self.board[move.end_row][move.end_col + 1] = '--'
+                    squares[end_sq - 2] = squares[end_sq + 1]
+                    squares[end_sq + 1] = EMPTY
             self.checkmate = False
             self.stalemate = False
+            self.rep_stalemate = False
+            self.move_draw = False
 
     # FIX BUG WITH VALID MOVES
     def fen_to_board(self, fen):
@@ -172,6 +453,23 @@ class GameState:
             board.append(brow)
         return board
 
+    def load_fen_state(self, fen):
+        # the fields after the piece placement: side to move, castling, en-passant square and the two clocks
+        fields = fen.split()
+        if len(fields) > 1:
+            self.white_to_move = fields[1] != "b"
+        if len(fields) > 2:
+            self.castling_rights = 0
+            for char, right in (("K", WKS), ("Q", WQS), ("k", BKS), ("q", BQS)):
+                if char in fields[2]:
+                    self.castling_rights |= right
+        if len(fields) > 3 and fields[3] != "-":
+            self.enpassant_square = square(8 - int(fields[3][1]), Move.files_to_cols[fields[3][0]])
+        if len(fields) > 4:
+            self.halfmove_clock = int(fields[4])
+        if len(fields) > 5:
+            self.fullmove_number = int(fields[5])
+
     # NOT FINISHED
     def board_to_fen(self):
         fen = ''
@@ -190,7 +488,7 @@ class GameState:
             fen += '/'
 
         fen = fen[:-1]  # Remove the trailing '/'
-        fen += ' ' + ('w' if self.white_to_move else 'b') + ' ' + self.castling_availability + ' ' + \
+        fen += ' ' + ('w' if self.white_to_move else 'b') + ' ' + (self.castling_availability or '-') + ' ' + \
                ('-' if self.enpassant_possible == () else self.coordinate_to_square(self.enpassant_possible)) + \
                ' ' + str(self.halfmove_clock) + ' ' + str(self.fullmove_number)
         return fen
@@ -221,402 +519,341 @@ class GameState:
         return score
 
     def updateCastleRights(self, move):
-        if move.piece_captured == "wR":
-            if move.end_col == 0:  # left rook
-                self.current_castling_rights.wqs = False
-            elif move.end_col == 7:  # right rook
-                self.current_castling_rights.wks = False
-        elif move.piece_captured == "bR":
-            if move.end_col == 0:  # left rook
-                self.current_castling_rights.bqs = False
-            elif move.end_col == 7:  # right rook
-                self.current_castling_rights.bks = False
-
-        if move.piece_moved == 'wK':
-            self.current_castling_rights.wqs = False
-            self.current_castling_rights.wks = False
-        elif move.piece_moved == 'bK':
-            self.current_castling_rights.bqs = False
-            self.current_castling_rights.bks = False
-
-        # if rook was captured
-        elif move.piece_moved == 'wR':
-            if move.start_row == 7:
-                if move.start_col == 0:  # left rook
-                    self.current_castling_rights.wqs = False
-                elif move.start_col == 7:  # right rook
-                    self.current_castling_rights.wks = False
-        elif move.piece_moved == 'bR':
-            if move.start_row == 0:
-                if move.start_col == 0:  # left rook
-                    self.current_castling_rights.bqs = False
-                elif move.start_col == 7:  # right rook
-                    self.current_castling_rights.bks = False
+        # a king or rook leaving its square, or a rook being captured on it, removes the matching rights
+        self.castling_rights &= CASTLE_MASK[move.start_sq] & CASTLE_MASK[move.end_sq]
 
     def getValidMoves(self):
-        temp_castle_rights = CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                          self.current_castling_rights.wqs, self.current_castling_rights.bqs)
+        moves = self.generateMoves()
+
+        if len(moves) == 0:
+            if self.inCheck():
+                self.checkmate = True
+            else:
+                self.stalemate = True
+
+        else:
+            self.checkmate = False
+            self.stalemate = False
+
+        # a checkmate on the last move still counts, otherwise threefold repetition and the fifty-move rule end the game
+        self.rep_stalemate = not self.checkmate and self.repetitionCount() >= 2
+        self.move_draw = not self.checkmate and self.halfmove_clock >= 100
+
+        return moves
+
+    def repetitionCount(self):
+        # how often the position occurred before. a capture or pawn move can not be taken back, so only the positions
+        # since the halfmove clock was reset are compared, every second one with the same side to move. the keys
+        # include the castling rights and the en-passant square, so positions that only look alike differ
+        zobrist_log = self.zobrist_log
+        key = self.zobrist_key
+        count = 0
+        for i in range(len(zobrist_log) - 3, max(len(zobrist_log) - 2 - self.halfmove_clock, -1), -2):
+            if zobrist_log[i] == key:
+                count += 1
+        return count
+
+    def generateMoves(self, captures_only=False):
         # advanced algorithm
+        # with captures_only only captures and promotions are generated, unless the king is in check,
+        # then every move out of check is
         moves = []
         self.in_check, self.pins, self.checks = self.checkForPinsAndChecks()
 
         if self.white_to_move:
-            king_row = self.white_king_location[0]
-            king_col = self.white_king_location[1]
+            king_sq = self.white_king_sq
         else:
-            king_row = self.black_king_location[0]
-            king_col = self.black_king_location[1]
+            king_sq = self.black_king_sq
         if self.in_check:
             if len(self.checks) == 1:  # only 1 check, block the check or move the king
                 moves = self.getAllPossibleMoves()
                 # to block the check you must put a piece into one of the squares between the enemy piece and your king
-                check = self.checks[0]  # check information
-                check_row = check[0]
-                check_col = check[1]
-                piece_checking = self.board[check_row][check_col]
-                valid_squares = []  # squares that pieces can move to
+                check_sq, check_direction = self.checks[0]  # check information
                 # if knight, must capture the knight or move your king, other pieces can be blocked
-                if piece_checking[1] == "N":
-                    valid_squares = [(check_row, check_col)]
+                if self.squares[check_sq] & 7 == KNIGHT:
+                    valid_squares = {check_sq}
                 else:
-                    for i in range(1, 8):
-                        valid_square = (king_row + check[2] * i,
-                                        king_col + check[3] * i)  # check[2] and check[3] are the check directions
-                        valid_squares.append(valid_square)
-                        if valid_square[0] == check_row and valid_square[
-                            1] == check_col:  # once you get to piece and check
-                            break
+                    valid_squares = set()  # squares that pieces can move to
+                    valid_square = king_sq
+                    while valid_square != check_sq:  # once you get to piece and check
+                        valid_square += check_direction
+                        valid_squares.add(valid_square)
                 # get rid of any moves that don't block check or move king
-                for i in range(len(moves) - 1, -1, -1):  # iterate through the list backwards when removing elements
-                    if moves[i].piece_moved[1] != "K":  # move doesn't move king, so it must block or capture
-                        if not (moves[i].end_row,
-                                moves[i].end_col) in valid_squares:  # move doesn't block or capture piece
-                            moves.remove(moves[i])
+                # (an en-passant capture removes the checking pawn without landing on its square)
+                moves = [move for move in moves if move.moved & 7 == KING or move.end_sq in valid_squares or (
+                        move.is_enpassant_move and move.start_sq - move.start_col + move.end_col == check_sq)]
             else:  # double check, king has to move
-                self.getKingMoves(king_row, king_col, moves)
+                self.getKingMoves(king_sq, moves)
+        elif captures_only:
+            self.captures_only = True
+            moves = self.getAllPossibleMoves()
+            self.captures_only = False
         else:  # not in check - all moves are fine
             moves = self.getAllPossibleMoves()
-            if self.white_to_move:
-                self.getCastleMoves(self.white_king_location[0], self.white_king_location[1], moves)
-            else:
-                self.getCastleMoves(self.black_king_location[0], self.black_king_location[1], moves)
-
-        if len(moves) == 0:
-            if self.inCheck():
-                self.checkmate = True
-                #self.SOUNDS["game-end"].play()
-            else:
-                self.stalemate = True
-                #self.SOUNDS["game-end"].play()
-
-        else:
-            self.checkmate = False
-            self.stalemate = False
-
-        if len(self.move_log) > 6 and self.move_log[-1] == self.move_log[-3] == self.move_log[-5]:
-            self.rep_stalemate = True
-            # self.SOUNDS["game-end"].play()
+            self.getCastleMoves(king_sq, moves)
 
-        self.current_castling_rights = temp_castle_rights
         return moves
 
     def inCheck(self):
         if self.white_to_move:
-            return self.squareUnderAttack(self.white_king_location[0], self.white_king_location[1])
+            return self.squareUnderAttack(self.white_king_sq)
         else:
-            return self.squareUnderAttack(self.black_king_location[0], self.black_king_location[1])
-
-    def squareUnderAttack(self, row, col):
-        self.white_to_move = not self.white_to_move  # switch to opponent's point of view
-        opponents_moves = self.getAllPossibleMoves()
-        self.white_to_move = not self.white_to_move
-        for move in opponents_moves:
-            if move.end_row == row and move.end_col == col:  # square is under attack
+            return self.squareUnderAttack(self.black_king_sq)
+
+    def squareUnderAttack(self, sq):
+        return self.squareAttackedBy(sq, BLACK if self.white_to_move else WHITE)
+
+    def squareAttackedBy(self, sq, color):
+        # looks outward from the square for a piece of the given color that attacks it: pawn diagonals,
+        # knight jumps, king steps and the first piece along every ray
+        squares = self.squares
+        pawn = color | PAWN
+        if color == WHITE:  # pawns attack up the board, so a white attacker sits one row below the square
+            if squares[sq + 9] == pawn or squares[sq + 11] == pawn:
+                return True
+        elif squares[sq - 9] == pawn or squares[sq - 11] == pawn:
+            return True
+        knight = color | KNIGHT
+        for move in KNIGHT_MOVES:
+            if squares[sq + move] == knight:
+                return True
+        king = color | KING
+        for direction in KING_DIRECTIONS:
+            if squares[sq + direction] == king:
+                return True
+        rook, bishop, queen = color | ROOK, color | BISHOP, color | QUEEN
+        for direction in ROOK_DIRECTIONS:
+            end_sq = sq + direction
+            while squares[end_sq] == EMPTY:
+                end_sq += direction
+            if squares[end_sq] == rook or squares[end_sq] == queen:
+                return True
+        for direction in BISHOP_DIRECTIONS:
+            end_sq = sq + direction
+            while squares[end_sq] == EMPTY:
+                end_sq += direction
+            if squares[end_sq] == bishop or squares[end_sq] == queen:
                 return True
         return False
 
     def getAllPossibleMoves(self):
         moves = []
-        for row in range(len(self.board)):
-            for col in range(len(self.board[row])):
-                turn = self.board[row][col][0]
-                if (turn == "w" and self.white_to_move) or (turn == "b" and not self.white_to_move):
-                    piece = self.board[row][col][1]
-                    self.moveFunctions[piece](row, col, moves)  # calls appropriate move function based on piece type
+        squares = self.squares
+        ally_color = WHITE if self.white_to_move else BLACK
+        move_functions = self.moveFunctions
+        for sq in SQUARES:
+            piece = squares[sq]
+            if piece & ally_color:
+                move_functions[piece & 7](sq, moves)  # calls appropriate move function based on piece type
         return moves
 
-    def checkForPinsAndChecks(self):
-        pins = []  # squares pinned and the direction its pinned from
+    def hasLegalMove(self):
+        # whether the side to move has a legal move at all, the pieces generate their moves one after the other until
+        # one of them has some. a king that can castle can also step aside, so castling is never the only move.
+        # the king must not be in check, generateMoves finds the ways out of a check
+        self.in_check, self.pins, self.checks = self.checkForPinsAndChecks()
+        squares = self.squares
+        ally_color = WHITE if self.white_to_move else BLACK
+        moves = []
+        for sq in SQUARES:
+            piece = squares[sq]
+            if piece & ally_color:
+                self.moveFunctions[piece & 7](sq, moves)
+                if moves:
+                    return True
+        return False
+
+    def getLegalMove(self, move_id):
+        # the move with the given moveID if it is legal in this position, None otherwise. only the piece on its start
+        # square generates its moves, so the move of the transposition table or a killer is checked without
+        # generating all the others. the king must not be in check, generateMoves finds the ways out of a check
+        start_sq = SQUARES[move_id & 63]
+        piece = self.squares[start_sq]
+        if not piece & (WHITE if self.white_to_move else BLACK):
+            return None
+        self.in_check, self.pins, self.checks = self.checkForPinsAndChecks()
+        moves = []
+        self.moveFunctions[piece & 7](start_sq, moves)
+        if piece & 7 == KING:
+            self.getCastleMoves(start_sq, moves)
+        return next((move for move in moves if move.moveID == move_id), None)
+
+    def checkForPinsAndChecks(self, king_sq=None):
+        # king_sq can be given to look for checks on a square the king is about to move to
+        pins = {}  # squares pinned and the direction its pinned from
         checks = []  # squares where enemy is applying a check
         in_check = False
+        squares = self.squares
         if self.white_to_move:
-            enemy_color = "b"
-            ally_color = "w"
-            start_row = self.white_king_location[0]
-            start_col = self.white_king_location[1]
+            enemy_color = BLACK
+            ally_color = WHITE
+            start_sq = self.white_king_sq if king_sq is None else king_sq
+            pawn_directions = (-11, -9)  # black pawns attack the king from above
         else:
-            enemy_color = "w"
-            ally_color = "b"
-            start_row = self.black_king_location[0]
-            start_col = self.black_king_location[1]
+            enemy_color = WHITE
+            ally_color = BLACK
+            start_sq = self.black_king_sq if king_sq is None else king_sq
+            pawn_directions = (11, 9)  # white pawns attack the king from below
         # check outwards from king for pins and checks, keep track of pins
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)):
-            direction = directions[j]
-            possible_pin = ()  # reset possible pins
-            for i in range(1, 8):
-                end_row = start_row + direction[0] * i
-                end_col = start_col + direction[1] * i
-                if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] == ally_color and end_piece[1] != "K":
-                        if possible_pin == ():  # first allied piece could be pinned
-                            possible_pin = (end_row, end_col, direction[0], direction[1])
+        for j in range(8):
+            direction = KING_DIRECTIONS[j]
+            possible_pin = 0  # reset possible pins
+            end_sq = start_sq + direction
+            i = 1
+            while True:
+                end_piece = squares[end_sq]
+                if end_piece & ally_color:
+                    if end_piece & 7 != KING:  # the king itself is transparent when it tests the square it moves to
+                        if possible_pin == 0:  # first allied piece could be pinned
+                            possible_pin = end_sq
                         else:  # 2nd allied piece - no check or pin from this direction
                             break
-                    elif end_piece[0] == enemy_color:
-                        enemy_type = end_piece[1]
-                        # 5 possibilities in this complex conditional
-                        # 1.) orthogonally away from king and piece is a rook
-                        # 2.) diagonally away from king and piece is a bishop
-                        # 3.) 1 square away diagonally from king and piece is a pawn
-                        # 4.) any direction and piece is a queen
-                        # 5.) any direction 1 square away and piece is a king
-                        if (0 <= j <= 3 and enemy_type == "R") or (4 <= j <= 7 and enemy_type == "B") or (
-                                i == 1 and enemy_type == "p" and (
-                                (enemy_color == "w" and 6 <= j <= 7) or (enemy_color == "b" and 4 <= j <= 5))) or (
-                                enemy_type == "Q") or (i == 1 and enemy_type == "K"):
-                            if possible_pin == ():  # no piece blocking, so check
-                                in_check = True
-                                checks.append((end_row, end_col, direction[0], direction[1]))
-                                break
-                            else:  # piece blocking so pin
-                                pins.append(possible_pin)
-                                break
-                        else:  # enemy piece not applying checks
-                            break
-                else:
-                    break  # off board
+                elif end_piece & enemy_color:
+                    enemy_type = end_piece & 7
+                    # 5 possibilities in this complex conditional
+                    # 1.) orthogonally away from king and piece is a rook
+                    # 2.) diagonally away from king and piece is a bishop
+                    # 3.) 1 square away diagonally from king and piece is a pawn
+                    # 4.) any direction and piece is a queen
+                    # 5.) any direction 1 square away and piece is a king
+                    if (j <= 3 and enemy_type == ROOK) or (4 <= j and enemy_type == BISHOP) or (
+                            i == 1 and enemy_type == PAWN and direction in pawn_directions) or (
+                            enemy_type == QUEEN) or (i == 1 and enemy_type == KING):
+                        if possible_pin == 0:  # no piece blocking, so check
+                            in_check = True
+                            checks.append((end_sq, direction))
+                        else:  # piece blocking so pin
+                            pins[possible_pin] = direction
+                    break  # enemy piece found, with or without a check
+                elif end_piece == OFFBOARD:
+                    break
+                end_sq += direction
+                i += 1
         # check for knight checks
-        knight_moves = ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2), (1, -2))
-        for move in knight_moves:
-            end_row = start_row + move[0]
-            end_col = start_col + move[1]
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] == enemy_color and end_piece[1] == "N":  # enemy knight attacking a king
-                    in_check = True
-                    checks.append((end_row, end_col, move[0], move[1]))
+        enemy_knight = enemy_color | KNIGHT
+        for move in KNIGHT_MOVES:
+            if squares[start_sq + move] == enemy_knight:  # enemy knight attacking a king
+                in_check = True
+                checks.append((start_sq + move, move))
         return in_check, pins, checks
 
-    def getPawnMoves(self, row, col, moves):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][1] == col:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
+    def getPawnMoves(self, sq, moves):
+        squares = self.squares
+        pin_direction = self.pins.get(sq)
 
         if self.white_to_move:
-            move_amount = -1
+            move_amount = -10
             start_row = 6
-            enemy_color = "b"
-            king_row, king_col = self.white_king_location
+            enemy_color = BLACK
         else:
-            move_amount = 1
+            move_amount = 10
             start_row = 1
-            enemy_color = "w"
-            king_row, king_col = self.black_king_location
-
-        if self.board[row + move_amount][col] == "--":  # 1 square pawn advance
-            if not piece_pinned or pin_direction == (move_amount, 0):
-                moves.append(Move((row, col), (row + move_amount, col), self.board))
-                if row == start_row and self.board[row + 2 * move_amount][col] == "--":  # 2 square pawn advance
-                    moves.append(Move((row, col), (row + 2 * move_amount, col), self.board))
-        if col - 1 >= 0:  # capture to the left
-            if not piece_pinned or pin_direction == (move_amount, -1):
-                if self.board[row + move_amount][col - 1][0] == enemy_color:
-                    moves.append(Move((row, col), (row + move_amount, col - 1), self.board))
-                if (row + move_amount, col - 1) == self.enpassant_possible:
-                    attacking_piece = blocking_piece = False
-                    if king_row == row:
-                        if king_col < col:  # king is left of the pawn
-                            # inside: between king and the pawn;
-                            # outside: between pawn and border;
-                            inside_range = range(king_col + 1, col - 1)
-                            outside_range = range(col + 1, 8)
-                        else:  # king right of the pawn
-                            inside_range = range(king_col - 1, col, -1)
-                            outside_range = range(col - 2, -1, -1)
-                        for i in inside_range:
-                            if self.board[row][i] != "--":  # some piece beside en-passant pawn blocks
-                                blocking_piece = True
-                        for i in outside_range:
-                            square = self.board[row][i]
-                            if square[0] == enemy_color and (square[1] == "R" or square[1] == "Q"):
-                                attacking_piece = True
-                            elif square != "--":
-                                blocking_piece = True
-                    if not attacking_piece or blocking_piece:
-                        moves.append(Move((row, col), (row + move_amount, col - 1), self.board, is_enpassant_move=True))
-        if col + 1 <= 7:  # capture to the right
-            if not piece_pinned or pin_direction == (move_amount, +1):
-                if self.board[row + move_amount][col + 1][0] == enemy_color:
-                    moves.append(Move((row, col), (row + move_amount, col + 1), self.board))
-                if (row + move_amount, col + 1) == self.enpassant_possible:
-                    attacking_piece = blocking_piece = False
-                    if king_row == row:
-                        if king_col < col:  # king is left of the pawn
-                            # inside: between king and the pawn;
-                            # outside: between pawn and border;
-                            inside_range = range(king_col + 1, col)
-                            outside_range = range(col + 2, 8)
-                        else:  # king right of the pawn
-                            inside_range = range(king_col - 1, col + 1, -1)
-                            outside_range = range(col - 1, -1, -1)
-                        for i in inside_range:
-                            if self.board[row][i] != "--":  # some piece beside en-passant pawn blocks
-                                blocking_piece = True
-                        for i in outside_range:
-                            square = self.board[row][i]
-                            if square[0] == enemy_color and (square[1] == "R" or square[1] == "Q"):
-                                attacking_piece = True
-                            elif square != "--":
-                                blocking_piece = True
-                    if not attacking_piece or blocking_piece:
-                        moves.append(Move((row, col), (row + move_amount, col + 1), self.board, is_enpassant_move=True))
-
-    def getRookMoves(self, row, col, moves):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][1] == col:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                if self.board[row][col][1] != "Q":  # can't remove queen from pin on rook moves, only remove it on bishop moves
-                    self.pins.remove(self.pins[i])
-                break
-
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))  # up, left, down, right
-        enemy_color = "b" if self.white_to_move else "w"
-        for direction in directions:
-            for i in range(1, 8):
-                end_row = row + direction[0] * i
-                end_col = col + direction[1] * i
-                if 0 <= end_row <= 7 and 0 <= end_col <= 7:  # check for possible moves only in boundaries of the board
-                    if not piece_pinned or pin_direction == direction or pin_direction == (
-                            -direction[0], -direction[1]):
-                        end_piece = self.board[end_row][end_col]
-                        if end_piece == "--":  # empty space is valid
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
-                        elif end_piece[0] == enemy_color:  # capture enemy piece
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
-                            break
-                        else:  # friendly piece
-                            break
-                else:  # off board
-                    break
-
-    def getKnightMoves(self, row, col, moves):
-        piece_pinned = False
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][1] == col:
-                piece_pinned = True
-                self.pins.remove(self.pins[i])
-                break
-
-        knight_moves = ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2),
-                        (1, -2))  # up/left up/right right/up right/down down/left down/right left/up left/down
-        ally_color = "w" if self.white_to_move else "b"
-        for move in knight_moves:
-            end_row = row + move[0]
-            end_col = col + move[1]
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                if not piece_pinned:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] != ally_color:  # so its either enemy piece or empty square
-                        moves.append(Move((row, col), (end_row, end_col), self.board))
-
-    def getBishopMoves(self, row, col, moves):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][1] == col:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-
-        directions = ((-1, -1), (-1, 1), (1, 1), (1, -1))  # diagonals: up/left up/right down/right down/left
-        enemy_color = "b" if self.white_to_move else "w"
+            enemy_color = WHITE
+
+        end_sq = sq + move_amount
+        if squares[end_sq] == EMPTY and (not self.captures_only or squares[end_sq + move_amount] == OFFBOARD):
+            # 1 square pawn advance, which is only a promotion when captures are generated
+            if pin_direction is None or pin_direction == move_amount or pin_direction == -move_amount:
+                append_pawn_move(moves, sq, end_sq, squares, self.captures_only)
+                if SQ_ROW[sq] == start_row and squares[end_sq + move_amount] == EMPTY:  # 2 square pawn advance
+                    moves.append(Move(sq, end_sq + move_amount, squares))
+        for capture_direction in (move_amount - 1, move_amount + 1):  # capture to the left and to the right
+            if pin_direction is None or pin_direction == capture_direction or pin_direction == -capture_direction:
+                end_sq = sq + capture_direction
+                if squares[end_sq] & enemy_color:
+                    append_pawn_move(moves, sq, end_sq, squares, self.captures_only)
+                elif end_sq == self.enpassant_square and self.enpassantIsLegal(sq, end_sq):
+                    moves.append(Move(sq, end_sq, squares, is_enpassant_move=True))
+
+    def enpassantIsLegal(self, sq, end_sq):
+        # an en-passant capture takes two pawns off the same row at once, which can expose the king to a rook or queen
+        # (or a bishop behind the captured pawn) that neither pawn was pinned by on its own, so try it on the board
+        squares = self.squares
+        captured_sq = sq - SQ_COL[sq] + SQ_COL[end_sq]
+        pawn, captured = squares[sq], squares[captured_sq]
+        squares[sq] = squares[captured_sq] = EMPTY
+        squares[end_sq] = pawn
+        in_check = self.checkForPinsAndChecks()[0]
+        squares[sq], squares[captured_sq], squares[end_sq] = pawn, captured, EMPTY
+        return not in_check
+
+    def getSlidingMoves(self, sq, directions, moves):
+        squares = self.squares
+        pin_direction = self.pins.get(sq)
+        enemy_color = BLACK if self.white_to_move else WHITE
         for direction in directions:
-            for i in range(1, 8):
-                end_row = row + direction[0] * i
-                end_col = col + direction[1] * i
-                if 0 <= end_row <= 7 and 0 <= end_col <= 7:  # check if the move is on board
-                    if not piece_pinned or pin_direction == direction or pin_direction == (
-                            -direction[0], -direction[1]):
-                        end_piece = self.board[end_row][end_col]
-                        if end_piece == "--":  # empty space is valid
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
-                        elif end_piece[0] == enemy_color:  # capture enemy piece
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
-                            break
-                        else:  # friendly piece
-                            break
-                else:  # off board
-                    break
-
-    def getQueenMoves(self, row, col, moves):
-        self.getBishopMoves(row, col, moves)
-        self.getRookMoves(row, col, moves)
-
-    def getKingMoves(self, row, col, moves):
-        row_moves = (-1, -1, -1, 0, 0, 1, 1, 1)
-        col_moves = (-1, 0, 1, -1, 1, -1, 0, 1)
-        ally_color = "w" if self.white_to_move else "b"
-        for i in range(8):
-            end_row = row + row_moves[i]
-            end_col = col + col_moves[i]
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] != ally_color:  # not an allied piece - empty or enemy
-                    # place king on end square and check for checks
-                    if ally_color == "w":
-                        self.white_king_location = (end_row, end_col)
-                    else:
-                        self.black_king_location = (end_row, end_col)
-                    in_check, pins, checks = self.checkForPinsAndChecks()
-                    if not in_check:
-                        moves.append(Move((row, col), (end_row, end_col), self.board))
-                    # place king back on original location
-                    if ally_color == "w":
-                        self.white_king_location = (row, col)
-                    else:
-                        self.black_king_location = (row, col)
-
-    def getCastleMoves(self, row, col, moves):
+            # a pinned piece can only move along the line of the pin
+            if pin_direction is None or pin_direction == direction or pin_direction == -direction:
+                end_sq = sq + direction
+                while True:
+                    end_piece = squares[end_sq]
+                    if end_piece == EMPTY:  # empty space is valid
+                        if not self.captures_only:
+                            moves.append(Move(sq, end_sq, squares))
+                    elif end_piece & enemy_color:  # capture enemy piece
+                        moves.append(Move(sq, end_sq, squares))
+                        break
+                    else:  # friendly piece or off board
+                        break
+                    end_sq += direction
+
+    def getRookMoves(self, sq, moves):
+        self.getSlidingMoves(sq, ROOK_DIRECTIONS, moves)
+
+    def getKnightMoves(self, sq, moves):
+        if sq in self.pins:  # a pinned knight can never move
+            return
+
+        squares = self.squares
+        ally_color = WHITE if self.white_to_move else BLACK
+        for move in KNIGHT_MOVES:
+            end_piece = squares[sq + move]
+            if end_piece == EMPTY and self.captures_only:
+                continue
+            if not end_piece & (ally_color | OFFBOARD):  # so its either enemy piece or empty square
+                moves.append(Move(sq, sq + move, squares))
+
+    def getBishopMoves(self, sq, moves):
+        self.getSlidingMoves(sq, BISHOP_DIRECTIONS, moves)
+
+    def getQueenMoves(self, sq, moves):
+        self.getSlidingMoves(sq, BISHOP_DIRECTIONS, moves)
+        self.getSlidingMoves(sq, ROOK_DIRECTIONS, moves)
+
+    def getKingMoves(self, sq, moves):
+        squares = self.squares
+        ally_color = WHITE if self.white_to_move else BLACK
+        for direction in KING_DIRECTIONS:
+            end_sq = sq + direction
+            end_piece = squares[end_sq]
+            if end_piece == EMPTY and self.captures_only:
+                continue
+            if not end_piece & (ally_color | OFFBOARD):  # not an allied piece - empty or enemy
+                # check for checks with the king placed on the end square
+                in_check, pins, checks = self.checkForPinsAndChecks(end_sq)
+                if not in_check:
+                    moves.append(Move(sq, end_sq, squares))
+
+    def getCastleMoves(self, sq, moves):
         # get the castle moves for the king
-        if self.squareUnderAttack(row, col):
+        if self.in_check:
             return  # can't castle while in check
-        if (self.white_to_move and self.current_castling_rights.wks) or (
-                not self.white_to_move and self.current_castling_rights.bks):
-            self.getKingsideCastleMoves(row, col, moves)
-        if (self.white_to_move and self.current_castling_rights.wqs) or (
-                not self.white_to_move and self.current_castling_rights.bqs):
-            self.getQueensideCastleMoves(row, col, moves)
+        if (self.white_to_move and self.castling_rights & WKS) or (
+                not self.white_to_move and self.castling_rights & BKS):
+            self.getKingsideCastleMoves(sq, moves)
+        if (self.white_to_move and self.castling_rights & WQS) or (
+                not self.white_to_move and self.castling_rights & BQS):
+            self.getQueensideCastleMoves(sq, moves)
 
-    def getKingsideCastleMoves(self, row, col, moves):
-        if self.board[row][col + 1] == '--' and self.board[row][col + 2] == '--':
-            if not self.squareUnderAttack(row, col + 1) and not self.squareUnderAttack(row, col + 2):
-                moves.append(Move((row, col), (row, col + 2), self.board, is_castle_move=True))
+    def getKingsideCastleMoves(self, sq, moves):
+        if self.squares[sq + 1] == EMPTY and self.squares[sq + 2] == EMPTY:
+            if not self.squareUnderAttack(sq + 1) and not self.squareUnderAttack(sq + 2):
+                moves.append(Move(sq, sq + 2, self.squares, is_castle_move=True))
 
-    def getQueensideCastleMoves(self, row, col, moves):
-        if self.board[row][col - 1] == '--' and self.board[row][col - 2] == '--' and self.board[row][col - 3] == '--':
-            if not self.squareUnderAttack(row, col - 1) and not self.squareUnderAttack(row, col - 2):
-                moves.append(Move((row, col), (row, col - 2), self.board, is_castle_move=True))
+    def getQueensideCastleMoves(self, sq, moves):
+        if self.squares[sq - 1] == EMPTY and self.squares[sq - 2] == EMPTY and self.squares[sq - 3] == EMPTY:
+            if not self.squareUnderAttack(sq - 1) and not self.squareUnderAttack(sq - 2):
+                moves.append(Move(sq, sq - 2, self.squares, is_castle_move=True))
 
 
 class CastleRights:
@@ -638,25 +875,87 @@ class Move:
                      "e": 4, "f": 5, "g": 6, "h": 7}
     cols_to_files = {v: k for k, v in files_to_cols.items()}
 
-    def __init__(self, start_square, end_square, board, is_enpassant_move=False, is_castle_move=False):
-        self.start_row = start_square[0]
-        self.start_col = start_square[1]
-        self.end_row = end_square[0]
-        self.end_col = end_square[1]
-        self.piece_moved = board[self.start_row][self.start_col]
-        self.piece_captured = board[self.end_row][self.end_col]
-        # pawn promotion
-        self.is_pawn_promotion = (self.piece_moved == "wp" and self.end_row == 0) or (
-                self.piece_moved == "bp" and self.end_row == 7)
-        # en passant
-        self.is_enpassant_move = is_enpassant_move
-        if self.is_enpassant_move:
-            self.piece_captured = "wp" if self.piece_moved == "bp" else "bp"
-        # castle move
-        self.is_castle_move = is_castle_move
+    __slots__ = ("data", "moved", "captured")
 
-        self.is_capture = self.piece_captured != "--"
-        self.moveID = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col
+    def __init__(self, start_square, end_square, board, is_enpassant_move=False, is_castle_move=False, promotion=QUEEN):
+        if type(start_square) is tuple:
+            # (row, col) squares on the string board, as the UI builds them from mouse clicks
+            start_square = square(*start_square)
+            end_square = square(*end_square)
+            self.moved = moved = PIECE_CODES[board[SQ_ROW[start_square]][SQ_COL[start_square]]]
+            target = PIECE_CODES[board[SQ_ROW[end_square]][SQ_COL[end_square]]]
+        else:
+            # squares of the compact board, as the move generators build them
+            self.moved = moved = board[start_square]
+            target = board[end_square]
+        data = SQ_INDEX[start_square] | SQ_INDEX[end_square] << 6
+        if target != EMPTY or is_enpassant_move:
+            data |= MOVE_CAPTURE
+        if is_enpassant_move:
+            data |= MOVE_ENPASSANT
+        elif is_castle_move:
+            data |= MOVE_CASTLE
+        elif moved & 7 == PAWN and (SQ_ROW[end_square] == 0 or SQ_ROW[end_square] == 7):
+            data |= promotion << MOVE_PROMOTION_SHIFT
+        self.data = data
+        self.captured = EMPTY  # the captured piece is looked up when the move is made
+
+    # the attributes the UI and the search read, decoded from the packed move
+    @property
+    def start_sq(self):
+        return SQUARES[self.data & 63]
+
+    @property
+    def end_sq(self):
+        return SQUARES[self.data >> 6 & 63]
+
+    @property
+    def start_row(self):
+        return self.data >> 3 & 7
+
+    @property
+    def start_col(self):
+        return self.data & 7
+
+    @property
+    def end_row(self):
+        return self.data >> 9 & 7
+
+    @property
+    def end_col(self):
+        return self.data >> 6 & 7
+
+    @property
+    def promotion(self):
+        return self.data >> MOVE_PROMOTION_SHIFT & 7
+
+    @property
+    def is_pawn_promotion(self):
+        return self.data >> MOVE_PROMOTION_SHIFT & 7 != 0
+
+    @property
+    def is_capture(self):
+        return self.data & MOVE_CAPTURE != 0
+
+    @property
+    def is_enpassant_move(self):
+        return self.data & MOVE_ENPASSANT != 0
+
+    @property
+    def is_castle_move(self):
+        return self.data & MOVE_CASTLE != 0
+
+    @property
+    def piece_moved(self):
+        return PIECE_NAMES[self.moved]
+
+    @property
+    def piece_captured(self):
+        return PIECE_NAMES[self.captured]
+
+    @property
+    def moveID(self):
+        return self.data & MOVE_ID_MASK
 
     def __eq__(self, other):
         if isinstance(other, Move):
@@ -666,20 +965,57 @@ class Move:
     def getRankFile(self, row, col):
         return self.cols_to_files[col] + self.rows_to_ranks[row]
 
-    def __str__(self):
-        if self.is_castle_move:
-            return "0-0" if self.end_col == 6 else "0-0-0"
+    def getUciNotation(self):
+        # long algebraic notation, e2e4 or e7e8q
+        notation = self.getRankFile(self.start_row, self.start_col) + self.getRankFile(self.end_row, self.end_col)
+        if self.is_pawn_promotion:
+            notation += PIECE_NAMES[WHITE | self.promotion][1].lower()
+        return notation
+
+    def getSanNotation(self, valid_moves):
+        # standard algebraic notation without the check suffix, valid_moves are the legal moves of the position the
+        # move is made in and decide whether the start file or rank of a piece has to be named
+        data = self.data
+        if data & MOVE_CASTLE:
+            return "O-O" if data >> 6 & 7 == 6 else "O-O-O"
 
         end_square = self.getRankFile(self.end_row, self.end_col)
+        if self.moved & 7 == PAWN:
+            notation = self.cols_to_files[self.start_col] + "x" + end_square if data & MOVE_CAPTURE else end_square
+            if self.is_pawn_promotion:
+                notation += "=" + PIECE_NAMES[WHITE | self.promotion][1]
+            return notation
+
+        notation = PIECE_NAMES[self.moved][1]
+        rivals = [move for move in valid_moves if move.moved == self.moved and move.data >> 6 & 63 == data >> 6 & 63
+                  and move.data & 63 != data & 63]
+        if rivals:
+            if all(move.start_col != self.start_col for move in rivals):
+                notation += self.cols_to_files[self.start_col]
+            elif all(move.start_row != self.start_row for move in rivals):
+                notation += self.rows_to_ranks[self.start_row]
+            else:
+                notation += self.getRankFile(self.start_row, self.start_col)
+        if data & MOVE_CAPTURE:
+            notation += "x"
+        return notation + end_square
+
+    def __str__(self):
+        data = self.data
+        if data & MOVE_CASTLE:
+            return "0-0" if data >> 6 & 7 == 6 else "0-0-0"
+
+        end_square = self.cols_to_files[data >> 6 & 7] + self.rows_to_ranks[data >> 9 & 7]
 
-        if self.piece_moved[1] == "p":
-            if self.is_capture:
-                return self.cols_to_files[self.start_col] + "x" + end_square
+        if self.moved & 7 == PAWN:
+            if data & MOVE_CAPTURE:
+                return self.cols_to_files[data & 7] + "x" + end_square
             else:
-                return end_square + "Q" if self.is_pawn_promotion else end_square
+                promotion = data >> MOVE_PROMOTION_SHIFT & 7
+                return end_square + PIECE_NAMES[WHITE | promotion][1] if promotion else end_square
 
-        move_string = self.piece_moved[1]
-        if self.is_capture:
+        move_string = PIECE_NAMES[self.moved][1]
+        if data & MOVE_CAPTURE:
             move_string += "x"
         return move_string + end_square
 
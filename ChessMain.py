@@ -1,14 +1,14 @@
 import datetime
+import sys
 
 import ChessEngine
 import ChessAI
+import Profiler
 import yaml
 import os
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
 import pygame
 
-pygame.init()
-
 # load the config
 with open("config.yaml") as f:
     cfg = yaml.load(f, Loader=yaml.FullLoader)
@@ -26,13 +26,26 @@ DIMENSION = 8
 SQ_SIZE = BOARD_HEIGHT // DIMENSION
 
 MAX_FPS = cfg["animation"]["max_fps"]
+# the engine searches in a thread of this process and holds the GIL while it does, after the default switch interval
+# of 5 ms the loop would wake up from clock.tick that much too late and drop to about 25 fps while the engine thinks
+GIL_SWITCH_INTERVAL = 0.0002
 PIECE_PACKAGE = cfg["design"]["piece_set"]
 PIECES = {}
 IMGS = {}
+SOUNDS = {}  # shared audio cache, every sound is decoded the first time it is played
+
+UI_FONT = MOVE_LOG_FONT = EVAL_FONT = FEN_FONT = None  # created by init_pygame
 
-UI_FONT = pygame.font.SysFont("Arial", 32)
-MOVE_LOG_FONT = EVAL_FONT = pygame.font.SysFont("Arial", 12)
-FEN_FONT = pygame.font.SysFont("Arial", 10)
+
+def init_pygame():
+    # only the game starts pygame: the helper processes of the search import this module again as their main module
+    # and must stay headless
+    global UI_FONT, MOVE_LOG_FONT, EVAL_FONT, FEN_FONT
+    pygame.init()
+    sys.setswitchinterval(GIL_SWITCH_INTERVAL)
+    UI_FONT = pygame.font.SysFont("Arial", 32)
+    MOVE_LOG_FONT = EVAL_FONT = pygame.font.SysFont("Arial", 12)
+    FEN_FONT = pygame.font.SysFont("Arial", 10)
 
 
 class Button:
@@ -77,11 +90,32 @@ class UI:
         for img in images:
             IMGS[img] = pygame.image.load(os.path.join("imgs", img))
 
-    def draw_game_state(self, win, gamestate, valid_moves, square_selected, move_log_font, eval_font):
+    def get_sound(self, sound):
+        if sound not in SOUNDS:
+            SOUNDS[sound] = pygame.mixer.Sound(os.path.join("sounds", f"{sound}.mp3"))
+        return SOUNDS[sound]
+
+    def play_move_sound(self, gamestate, move):
+        if gamestate.checkmate or gamestate.stalemate or gamestate.rep_stalemate or gamestate.move_draw:
+            self.get_sound("game-end").play()
+        elif move.piece_captured != "--" and not move.is_pawn_promotion:
+            self.get_sound("capture").play()
+        elif move.is_castle_move:
+            self.get_sound("castle").play()
+        elif move.is_pawn_promotion:
+            self.get_sound("promote").play()
+        elif gamestate.inCheck():
+            self.get_sound("move-check").play()
+        else:
+            self.get_sound("move-normal").play()
+
+    def draw_game_state(self, win, gamestate, valid_moves, square_selected, move_log_font, eval_font, search_stats=None):
         self.draw_board(win)
         self.highlight_squares(win, gamestate, valid_moves, square_selected)
         self.draw_pieces(win, gamestate.board)
         self.draw_move_log(win, gamestate, move_log_font)
+        if search_stats is not None and cfg["design"]["show_search_stats"]:
+            self.draw_search_stats(win, search_stats, move_log_font)
         # draw_eval_bar(win, gamestate, eval_font)
 
     def draw_board(self, win):
@@ -140,12 +174,37 @@ class UI:
             win.blit(text_object, text_loc)
             text_y += text_object.get_height()
 
+    def draw_search_stats(self, win, stats, font):
+        # the statistics of the running or the last search, at the bottom of the move log
+        if stats.book:
+            lines = [f"Book move {stats.best_move}"]
+        else:
+            lines = [
+                f"Depth {stats.depth}/{stats.seldepth}  {stats.best_move} ({stats.score})",
+                f"Nodes {stats.nodes} (quiescence {stats.qnodes})" + (
+                    f" + {stats.helper_nodes} helpers" if stats.helper_nodes else ""),
+                f"{stats.nps} nps  {stats.seconds:.2f}s",
+                f"TT {stats.tt_hits}/{stats.tt_probes} hits, {stats.tt_cutoffs} cutoffs",
+                f"First move cutoffs {stats.first_move_cutoff_rate:.0%}  EBF {stats.branching_factor:.1f}",
+                "Iterations " + " ".join(f"{seconds:.2f}" for seconds in stats.iteration_seconds[-5:]),
+            ]
+
+        padding = 5
+        line_height = font.get_linesize()
+        stats_rect = pygame.Rect(BOARD_WIDTH, MOVE_LOG_HEIGHT - len(lines) * line_height - 2 * padding, MOVE_LOG_WIDTH,
+                                 len(lines) * line_height + 2 * padding)
+        pygame.draw.rect(win, pygame.Color("gray15"), stats_rect)
+        text_y = stats_rect.y + padding
+        for line in lines:
+            win.blit(font.render(line, True, pygame.Color("white" if not stats.finished else "gray")),
+                     (stats_rect.x + padding, text_y))
+            text_y += line_height
+
     def draw_eval_bar(self, win, gamestate, eval_font):
         eval_bar_rect = pygame.Rect(-BOARD_WIDTH, 0, EVAL_BAR_WIDTH, EVAL_BAR_HEIGHT)
         pygame.draw.rect(win, pygame.Color("white"), eval_bar_rect)
 
-        eval = ChessEngine.GameState()
-        evaluation_score = eval.evaluate(gamestate.board)
+        evaluation_score = gamestate.evaluate(gamestate.board)
 
         if evaluation_score < 0:
             text_object = eval_font.render(str(evaluation_score), True, pygame.Color("Black"))
@@ -201,7 +260,7 @@ class Game:
 
     def home(self):
         ui = UI()
-        gamestate = ChessEngine.GameState()
+        gamestate = ChessEngine.new_game_state(backend=cfg["ai"]["backend"])
 
         settings_button = Button("settings", 728, 4, 30, 30, True)
         start_button = Button("start", 552, 59, 200, 50, True)
@@ -273,12 +332,18 @@ class Game:
         best_move_button = Button("best-move", 620, 100, 125, 20, True)
         # pos_to_fen_button = Button("pos-to-fen", 0, 0, 100, 50, True)
 
-        gamestate = ChessEngine.GameState(fen=self.start_fen)
+        gamestate = ChessEngine.new_game_state(fen=self.start_fen, backend=cfg["ai"]["backend"])
         ui = UI()
         valid_moves = gamestate.getValidMoves()
 
-        zobrist_keys = ChessAI.generate_zobrist_keys()
-        transposition_tale = {}
+        transposition_table = ChessAI.TranspositionTable(cfg["ai"]["hash_size_mb"])
+        # the engine searches in a background thread, the loop below only starts searches and collects their moves
+        search_worker = ChessAI.SearchWorker(transposition_table, True)
+        thinking = False  # a search for the AI's move is running
+        pondering = False  # a search on the human's time is running
+        search_info = {}  # latest progress of the running search, written by the worker thread
+        caption = pygame.display.get_caption()[0]
+        start_time = None
 
         move_made = False  # keeps track of a move being made so that the program doesn't load the valid moves every frame but only when a move is made
         game_over = False
@@ -301,18 +366,24 @@ class Game:
 
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
+                    search_worker.cancel()
+                    Profiler.write_report()
                     run = False
 
                 elif flip_board_button.click():
                     print("flip-board")
 
                 elif give_up_button.click():
+                    search_worker.cancel()
+                    Profiler.write_report()
                     return "resign"
 
                 elif best_move_button.click():
                     print("Calculating best move...")
-                    best_move = ChessAI.find_best_move(gamestate, valid_moves, zobrist_keys, transposition_tale, False)
-                    print(f"The best move in this position is {best_move} \n")
+                    if pondering:
+                        search_worker.cancel()
+                        pondering = False
+                    search_worker.search(gamestate, "hint")
 
                 elif event.type == pygame.MOUSEBUTTONDOWN:
                     if not game_over and human_turn:
@@ -337,6 +408,8 @@ class Game:
                             for i in range(len(valid_moves)):
                                 # only if a move is valid make it
                                 if move == valid_moves[i]:
+                                    search_worker.cancel()  # a ponder search or a hint is no longer needed
+                                    pondering = False
                                     gamestate.makeMove(valid_moves[i])
 
                                     move_made = True
@@ -352,13 +425,17 @@ class Game:
 
                 elif event.type == pygame.KEYDOWN:
                     if event.key == pygame.K_SPACE:
+                        search_worker.cancel()  # the position the engine is searching is gone
+                        thinking = pondering = False
                         gamestate.undoMove()
                         move_made = True
                         animate = False
                         game_over = False
 
                     elif event.key == pygame.K_r:
-                        gamestate = ChessEngine.GameState()
+                        search_worker.cancel()
+                        thinking = pondering = False
+                        gamestate = ChessEngine.new_game_state(backend=cfg["ai"]["backend"])
                         valid_moves = gamestate.getValidMoves()
                         square_selected = ()
                         player_clicks = []
@@ -367,28 +444,59 @@ class Game:
                         game_over = False
 
             # AI logic
-            if not game_over and not human_turn:
+            if not game_over and not human_turn and not thinking:
+                if pondering:
+                    search_worker.cancel()
+                    pondering = False
                 start_time = datetime.datetime.now()
-
-                AI_move = ChessAI.find_best_move(gamestate, valid_moves, zobrist_keys, transposition_tale, True)
-                if AI_move is None:
-                    AI_move = ChessAI.find_random_move(valid_moves)
-                    rand += 1
-                    print("Random Move Nr.", rand)
-
-                end_time = datetime.datetime.now()
-                thinking_time = end_time - start_time
-
-                print(f"This move took {str(thinking_time).split('.')[0]} to calculate. \n")
-                gamestate.makeMove(AI_move)
-                move_made = True
-                animate = True
+                search_info.clear()
+                search_worker.search(gamestate, "move", progress=lambda stats: search_info.update(stats=stats))
+                thinking = True
+
+            # think on the human's time while it is their turn against the AI
+            if cfg["ai"]["ponder"] and not game_over and human_turn and not thinking and not pondering and not (
+                    player_one and player_two):
+                search_worker.search(gamestate, "ponder", max_depth=ChessAI.MAX_PLY, time_limit=0,
+                                     node_limit=cfg["ai"]["ponder_node_limit"])
+                pondering = True
+
+            result = search_worker.poll()
+            if result is not None:
+                kind, AI_move, stats = result
+                if kind == "move":
+                    search_info["stats"] = stats
+                if kind == "hint":
+                    print(f"The best move in this position is {AI_move} \n")
+                elif kind == "move":
+                    thinking = False
+                    if AI_move is None:
+                        AI_move = ChessAI.find_random_move(valid_moves)
+                        rand += 1
+                        print("Random Move Nr.", rand)
+
+                    end_time = datetime.datetime.now()
+                    thinking_time = end_time - start_time
+
+                    print(f"This move took {str(thinking_time).split('.')[0]} to calculate. \n")
+                    gamestate.makeMove(AI_move)
+                    move_made = True
+                    animate = True
+                # a finished ponder search leaves pondering set, there is nothing more to do until the human moves
+
+            if thinking and "stats" in search_info:
+                stats = search_info["stats"]
+                pygame.display.set_caption(f"Thinking... depth {stats.depth}, {stats.best_move} ({stats.score}), "
+                                           f"{stats.nodes} nodes")
+            elif not thinking and pygame.display.get_caption()[0] != caption:
+                pygame.display.set_caption(caption)
 
             # when a valid move was made generate new moves
             if move_made:
                 if animate:
                     ui.animate_move(gamestate.move_log[-1], win, gamestate.board, clock)
                 valid_moves = gamestate.getValidMoves()
+                if cfg["design"]["play_sounds"] and len(gamestate.move_log) > 0:
+                    ui.play_move_sound(gamestate, gamestate.move_log[-1])
                 move_made = False
                 animate = False
 
@@ -402,7 +510,13 @@ class Game:
                 text = "Stalemate by Repetition"
                 ui.draw_end_game_text(win, text)
 
-            ui.draw_game_state(win, gamestate, valid_moves, square_selected, MOVE_LOG_FONT, EVAL_FONT)
+            if gamestate.move_draw:
+                game_over = True
+                text = "Draw by the Fifty-Move Rule"
+                ui.draw_end_game_text(win, text)
+
+            ui.draw_game_state(win, gamestate, valid_moves, square_selected, MOVE_LOG_FONT, EVAL_FONT,
+                               search_info.get("stats"))
 
             win.blit(IMGS["resign.png"], (620, 300))
             win.blit(IMGS["flip_board.png"], (620, 200))
@@ -413,6 +527,9 @@ class Game:
 
 
 if __name__ == "__main__":
+    init_pygame()
+    if cfg["profiling"]["enabled"]:
+        Profiler.install()
     game = Game()
 
     while True:
@@ -0,0 +1,40 @@
+import numpy as np
+
+from ChessEngine import SQUARES, PIECE_CODES, EMPTY, MATERIAL_SCORES, MIDGAME_SCORES, ENDGAME_SCORES, PHASE_SCORES, \
+    MAX_PHASE
+
+# a board is encoded as the 64 piece codes of its compact board (int8, a8 first). the 12 one-hot planes of a batch of
+# boards times one weight matrix give material, the two piece-square sums and the phase of every board at once
+_codes = [code for code in PIECE_CODES.values() if code != EMPTY]
+PLANE_PIECES = np.array(_codes, dtype=np.int8)
+PLAYABLE = np.array(SQUARES)
+WEIGHTS = np.array([[MATERIAL_SCORES[code], MIDGAME_SCORES[code * 120 + sq], ENDGAME_SCORES[code * 120 + sq],
+                     PHASE_SCORES[code]] for code in _codes for sq in SQUARES], dtype=np.int64)
+
+
+def encode_boards(boards):
+    # stacks the compact boards (bytes or bytearrays of 120 squares) into an n x 64 array of piece codes
+    return np.frombuffer(b"".join(boards), dtype=np.int8).reshape(len(boards), 120)[:, PLAYABLE]
+
+
+def score_boards(pieces, position_weight):
+    # material plus the tapered piece-square score of every encoded board, in the same order of operations as
+    # ChessAI.score_material_and_position so the scores match it exactly
+    planes = (pieces[:, None, :] == PLANE_PIECES[None, :, None]).reshape(len(pieces), -1).astype(np.int64)
+    material, midgame_position, endgame_position, phase = (planes @ WEIGHTS).T
+    phase = np.minimum(phase, MAX_PHASE)
+    position = (midgame_position * phase + endgame_position * (MAX_PHASE - phase)) / MAX_PHASE
+    return material + position * position_weight
+
+
+def score_children(gamestate, moves, position_weight):
+    # ChessAI.score_board_v3 of the position after every move, scored in one batch. checkmate and stalemate are not
+    # detected, the caller still has to look at them
+    boards = []
+    for move in moves:
+        gamestate.makeMove(move)
+        boards.append(bytes(gamestate.squares))
+        gamestate.undoMove()
+    if not boards:
+        return []
+    return score_boards(encode_boards(boards), position_weight).tolist()
@@ -0,0 +1,155 @@
+import argparse
+import json
+import os
+import shlex
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import ChessAI
+import ChessEngine
+
+# runs the engine over an EPD test suite, every line is a position (the first four FEN fields) followed by opcodes
+# like bm Qg6; id "WAC.001"; the best moves (bm) must be found and the avoid moves (am) must not be played
+# https://www.chessprogramming.org/Extended_Position_Description
+PENDING_PER_PROCESS = 2  # positions handed to every process at a time, the rest of the file is read when they finish
+
+
+def parse_epd(line):
+    # returns the fen and the opcodes of an EPD line as a dict of their operand lists
+    fields = line.split(maxsplit=4)
+    opcodes = {}
+    for operation in (fields[4] if len(fields) > 4 else "").split(";"):
+        words = shlex.split(operation)
+        if words:
+            opcodes[words[0]] = words[1:]
+    halfmove_clock = opcodes.get("hmvc", ["0"])[0]
+    fullmove_number = opcodes.get("fmvn", ["1"])[0]
+    return " ".join(fields[:4]) + f" {halfmove_clock} {fullmove_number}", opcodes
+
+
+def normalize_san(san):
+    # the suites write checks, annotations and castling in different ways
+    return san.rstrip("+#!?").replace("0", "O")
+
+
+def solve_position(line_number, line, backend, depth, movetime, node_limit):
+    # runs in a worker process, every position gets a fresh transposition table so the results do not depend on
+    # the order the positions are searched in
+    fen, opcodes = parse_epd(line)
+    best_moves = [normalize_san(san) for san in opcodes.get("bm", [])]
+    avoid_moves = [normalize_san(san) for san in opcodes.get("am", [])]
+    gamestate = ChessEngine.new_game_state(fen, backend)
+    valid_moves = gamestate.getValidMoves()
+    transposition_table = ChessAI.TranspositionTable(ChessAI.HASH_SIZE_MB, shared=False)
+
+    def solves(move):
+        san = move.getSanNotation(valid_moves)
+        return (not best_moves or san in best_moves) and san not in avoid_moves
+
+    # the time to the solution is the time of the first iteration from which on the best move stays a solution
+    iterations = []
+    start = time.perf_counter()
+
+    def progress(stats):
+        iterations.append((stats.depth, stats.best_move is not None and solves(stats.best_move), stats.seconds))
+
+    move = None
+    stats = ChessAI.SearchStats()  # a position without moves is not searched
+    if valid_moves:
+        move, stats = ChessAI.find_best_move(gamestate, valid_moves, transposition_table, False, depth, movetime,
+                                             node_limit, progress=progress)
+    seconds = time.perf_counter() - start
+
+    solved = None
+    solution_seconds = None
+    if best_moves or avoid_moves:
+        solved = move is not None and solves(move)
+        if solved:
+            solution_seconds = seconds
+            for iteration_depth, iteration_solved, iteration_seconds in reversed(iterations):
+                if not iteration_solved:
+                    break
+                solution_seconds = iteration_seconds
+
+    return {
+        "line": line_number,
+        "id": " ".join(opcodes.get("id", [])),
+        "fen": fen,
+        "bm": opcodes.get("bm", []),
+        "am": opcodes.get("am", []),
+        "move": move.getSanNotation(valid_moves) if move is not None else None,
+        "solved": solved,
+        "depth": iterations[-1][0] if iterations else 0,
+        "score": stats.score,  # pawns from the side to move, None for a book move
+        "nodes": stats.total_nodes,
+        "seconds": round(seconds, 3),
+        "nps": int(stats.total_nodes / max(seconds, 1e-9)),
+        "solution_seconds": round(solution_seconds, 3) if solution_seconds is not None else None,
+    }
+
+
+def read_positions(path):
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line_number, line
+
+
+def run(path, output_path, backend, depth, movetime, node_limit, processes):
+    results = []
+    with open(output_path, "w") as output:
+        def write(result):
+            results.append(result)
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+            print(f"{result['id'] or result['line']}: {result['move']} "
+                  f"{'' if result['solved'] is None else 'solved' if result['solved'] else 'FAILED'}")
+
+        if processes > 1:
+            # the file is streamed, only a few positions per process are read ahead of the finished ones
+            with ProcessPoolExecutor(processes) as pool:
+                pending = set()
+                for line_number, line in read_positions(path):
+                    pending.add(pool.submit(solve_position, line_number, line, backend, depth, movetime, node_limit))
+                    if len(pending) >= processes * PENDING_PER_PROCESS:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            write(future.result())
+                for future in wait(pending).done:
+                    write(future.result())
+        else:
+            for line_number, line in read_positions(path):
+                write(solve_position(line_number, line, backend, depth, movetime, node_limit))
+
+    summarize(results)
+    return results
+
+
+def summarize(results):
+    scored = [result for result in results if result["solved"] is not None]
+    solved = [result for result in scored if result["solved"]]
+    nodes = sum(result["nodes"] for result in results)
+    seconds = sum(result["seconds"] for result in results)
+    print(f"Solved {len(solved)} of {len(scored)} positions with bm or am opcodes ({len(results)} positions).")
+    if results:
+        print(f"Average nodes: {nodes / len(results):.0f}  Average nps: {nodes / max(seconds, 1e-9):.0f}  "
+              f"Average time: {seconds / len(results):.2f}s")
+    if solved:
+        print(f"Average time to solution: {sum(result['solution_seconds'] for result in solved) / len(solved):.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the positions of an EPD test suite and check the bm and am opcodes.")
+    parser.add_argument("epd")
+    parser.add_argument("--output", help="JSON lines file for the results, the EPD file name with .jsonl by default")
+    parser.add_argument("--depth", type=int, help="depth per position, the depth of the config when no limit is given")
+    parser.add_argument("--movetime", type=float, default=0, help="seconds per position")
+    parser.add_argument("--nodes", type=int, default=0, help="nodes per position")
+    parser.add_argument("--backend", default=ChessAI.cfg["ai"]["backend"], choices=("mailbox", "bitboard"))
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    depth = args.depth or (ChessAI.MAX_PLY if args.movetime or args.nodes else ChessAI.DEPTH)
+    run(args.epd, args.output or os.path.splitext(args.epd)[0] + ".jsonl", args.backend, depth, args.movetime,
+        args.nodes, args.processes)
@@ -0,0 +1,212 @@
+import argparse
+import copy
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import yaml
+
+import ChessAI
+import ChessEngine
+import Epd
+
+# plays two engine configurations against each other and decides with a sequential probability ratio test (SPRT)
+# whether the first one is stronger: the test stops as soon as the games are enough to accept or reject that its
+# Elo gain is at least elo1 rather than at most elo0
+# https://www.chessprogramming.org/Sequential_Probability_Ratio_Test
+OPENINGS = [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2",
+    "rnbqkbnr/pp1ppppp/8/2p5/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2",
+    "rnbqkbnr/pppp1ppp/4p3/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2",
+    "rnbqkbnr/pp1ppppp/2p5/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2",
+    "rnbqkbnr/ppp1pppp/8/3p4/3P4/8/PPP1PPPP/RNBQKBNR w KQkq - 0 2",
+    "rnbqkb1r/pppppppp/5n2/8/3P4/8/PPP1PPPP/RNBQKBNR w KQkq - 1 2",
+    "rnbqkbnr/pppppppp/8/8/2P5/8/PP1PPPPP/RNBQKBNR b KQkq - 0 1",
+]
+MAX_GAME_PLIES = 300  # longer games are adjudicated as draws
+
+# the evaluation settings of an engine configuration, with the ChessAI constants they set. the search settings
+# are version, depth, time_limit and node_limit
+ENGINE_SETTINGS = {
+    "positional_weight": "POSITION_WEIGHT",
+    "castling_score": "CASTLING_SCORE",
+    "move_repetition_punish": "MOVE_REP_PUNISH",
+    "quiescence_depth": "QUIESCENCE_DEPTH",
+    "delta_margin": "DELTA_MARGIN",
+}
+DEFAULTS = {"version": ChessAI.cfg["ai"]["version"], "depth": ChessAI.DEPTH, "time_limit": ChessAI.TIME_LIMIT,
+            "node_limit": ChessAI.NODE_LIMIT, **{key: ChessAI.cfg["ai"][key] for key in ENGINE_SETTINGS}}
+
+
+def parse_engine(text):
+    # an engine configuration like "version=v5,depth=4,positional_weight=0.2", the rest comes from the config
+    engine = dict(DEFAULTS)
+    for setting in filter(None, text.split(",")):
+        key, value = setting.split("=", 1)
+        if key not in DEFAULTS:
+            raise ValueError(f"unknown engine setting {key}, expected one of {', '.join(DEFAULTS)}")
+        engine[key] = yaml.safe_load(value)
+    if engine["version"] == "v3" and (engine["time_limit"] or engine["node_limit"]):
+        raise ValueError("version v3 searches to a fixed depth, it has no time_limit or node_limit")
+    return engine
+
+
+def configure(engine):
+    # the evaluators read module constants of ChessAI, they are set before every move of the engine
+    ChessAI.cfg["ai"]["version"] = engine["version"]
+    for key, name in ENGINE_SETTINGS.items():
+        setattr(ChessAI, name, engine[key])
+
+
+def play_game(number, fen, white, black, backend):
+    # runs in a worker process and returns the result for white (1, 0.5 or 0), why the game ended and the nodes,
+    # seconds and moves of both engines
+    gamestate = ChessEngine.new_game_state(fen, backend)
+    engines = (white, black)
+    tables = (ChessAI.TranspositionTable(ChessAI.HASH_SIZE_MB, shared=False),
+              ChessAI.TranspositionTable(ChessAI.HASH_SIZE_MB, shared=False))
+    nodes, seconds, moves = [0, 0], [0.0, 0.0], [0, 0]
+
+    while True:
+        valid_moves = gamestate.getValidMoves()
+        if gamestate.checkmate:
+            result, reason = (0 if gamestate.white_to_move else 1), "checkmate"
+            break
+        if gamestate.stalemate:
+            result, reason = 0.5, "stalemate"
+            break
+        if gamestate.rep_stalemate:
+            result, reason = 0.5, "repetition"
+            break
+        if gamestate.move_draw:
+            result, reason = 0.5, "fifty moves"
+            break
+        if len(gamestate.move_log) >= MAX_GAME_PLIES:
+            result, reason = 0.5, "adjudicated"
+            break
+
+        side = 0 if gamestate.white_to_move else 1
+        engine = engines[side]
+        configure(engine)
+        # the search works on a copy, so nothing it leaves in the game state can end the game
+        search_state = copy.deepcopy(gamestate)
+        start = time.perf_counter()
+        move, stats = ChessAI.find_best_move(search_state, search_state.getValidMoves(), tables[side], False,
+                                             engine["depth"], engine["time_limit"], engine["node_limit"])
+        seconds[side] += time.perf_counter() - start
+        nodes[side] += stats.total_nodes  # 0 for a move from the opening book
+        moves[side] += 1
+        move_id = move.moveID if move is not None else valid_moves[0].moveID
+        gamestate.makeMove(next(valid_move for valid_move in valid_moves if valid_move.moveID == move_id))
+
+    return {"game": number, "fen": fen, "result": result, "reason": reason, "plies": len(gamestate.move_log),
+            "nodes": nodes, "seconds": seconds, "moves": moves}
+
+
+def sprt_llr(wins, draws, losses, elo0, elo1):
+    # log-likelihood ratio of elo1 against elo0 with the normal approximation of the game results. half a game of
+    # every result keeps the variance above zero while all games ended the same way
+    wins, draws, losses = wins + 0.5, draws + 0.5, losses + 0.5
+    games = wins + draws + losses
+    score = (wins + draws / 2) / games
+    variance = (wins + draws / 4) / games - score ** 2
+    score0 = 1 / (1 + 10 ** (-elo0 / 400))
+    score1 = 1 / (1 + 10 ** (-elo1 / 400))
+    return (score1 - score0) * (2 * score - score0 - score1) / (2 * variance / games)
+
+
+def elo(score):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def elo_estimate(wins, draws, losses):
+    # the Elo difference and its 95% error margin
+    games = wins + draws + losses
+    score = (wins + draws / 2) / games
+    deviation = math.sqrt(max((wins + draws / 4) / games - score ** 2, 0) / games)
+    return elo(score), (elo(score + 1.96 * deviation) - elo(score - 1.96 * deviation)) / 2
+
+
+def run_match(engine1, engine2, games, openings, backend, processes, elo0, elo1, alpha, beta):
+    lower, upper = math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+    # every opening is played twice, with the engines swapping colors
+    jobs = [(number, openings[number // 2 % len(openings)], number % 2 == 0) for number in range(games)]
+    wins = draws = losses = 0
+    nodes, seconds, moves = [0, 0], [0.0, 0.0], [0, 0]
+    llr = 0.0
+
+    def results():
+        if processes > 1:
+            with ProcessPoolExecutor(processes) as pool:
+                futures = [pool.submit(play_game, number, fen, *((engine1, engine2) if first_white else (engine2, engine1)),
+                                       backend) for number, fen, first_white in jobs]
+                try:
+                    for future in as_completed(futures):
+                        yield future.result()
+                finally:
+                    for future in futures:
+                        future.cancel()
+        else:
+            for number, fen, first_white in jobs:
+                yield play_game(number, fen, *((engine1, engine2) if first_white else (engine2, engine1)), backend)
+
+    game_results = results()
+    for game in game_results:
+        first_white = jobs[game["game"]][2]
+        score = game["result"] if first_white else 1 - game["result"]
+        wins += score == 1
+        draws += score == 0.5
+        losses += score == 0
+        for engine, side in ((0, 0 if first_white else 1), (1, 1 if first_white else 0)):
+            nodes[engine] += game["nodes"][side]
+            seconds[engine] += game["seconds"][side]
+            moves[engine] += game["moves"][side]
+        llr = sprt_llr(wins, draws, losses, elo0, elo1)
+        print(f"Game {game['game'] + 1}: {score} for engine 1 ({game['reason']}, {game['plies']} plies)  "
+              f"+{wins} ={draws} -{losses}  LLR {llr:.2f} ({lower:.2f}, {upper:.2f})")
+        if not lower < llr < upper:
+            break
+    game_results.close()  # the games that did not start yet are cancelled
+
+    played = wins + draws + losses
+    print(f"Engine 1: {engine1}")
+    print(f"Engine 2: {engine2}")
+    print(f"{played} games: +{wins} ={draws} -{losses}, score {(wins + draws / 2) / max(played, 1):.1%}")
+    if played:
+        difference, margin = elo_estimate(wins, draws, losses)
+        print(f"Elo difference: {difference:.1f} +/- {margin:.1f}")
+    verdict = f"H1 accepted, engine 1 gains at least {elo1} Elo" if llr >= upper else \
+        f"H0 accepted, engine 1 gains at most {elo0} Elo" if llr <= lower else "inconclusive"
+    print(f"SPRT elo0={elo0} elo1={elo1} alpha={alpha} beta={beta}: LLR {llr:.2f} ({lower:.2f}, {upper:.2f}), {verdict}")
+    for engine in (0, 1):
+        print(f"Engine {engine + 1}: {nodes[engine] / max(seconds[engine], 1e-9):.0f} nps, "
+              f"{seconds[engine] / max(moves[engine], 1):.2f}s per move")
+    return wins, draws, losses, llr
+
+
+def read_openings(path):
+    # one FEN or EPD line per position
+    with open(path) as f:
+        return [Epd.parse_epd(line)[0] for line in f if line.strip() and not line.startswith("#")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play two engine configurations against each other with an SPRT.")
+    parser.add_argument("engine1", help='settings of the engine under test, like "version=v5,depth=4"')
+    parser.add_argument("engine2", help="settings of the baseline engine, the config is used for the rest")
+    parser.add_argument("--games", type=int, default=200)
+    parser.add_argument("--openings", help="file with a FEN or EPD position per line, a few standard openings by default")
+    parser.add_argument("--backend", default=ChessAI.cfg["ai"]["backend"], choices=("mailbox", "bitboard"))
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--elo0", type=float, default=0)
+    parser.add_argument("--elo1", type=float, default=10)
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    args = parser.parse_args()
+
+    run_match(parse_engine(args.engine1), parse_engine(args.engine2), args.games,
+              read_openings(args.openings) if args.openings else OPENINGS, args.backend, args.processes, args.elo0,
+              args.elo1, args.alpha, args.beta)
@@ -0,0 +1,113 @@
+import argparse
+import os
+import time
+import yaml
+from concurrent.futures import ProcessPoolExecutor
+
+import ChessEngine
+
+# load the config (relative to this file so it runs from any directory)
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.yaml")) as f:
+    cfg = yaml.load(f, Loader=yaml.FullLoader)
+
+# the standard perft positions with their known node counts per depth (depth 1 first)
+# https://www.chessprogramming.org/Perft_Results
+REFERENCE_POSITIONS = [
+    ("initial", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+     (20, 400, 8902, 197281, 4865609)),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     (48, 2039, 97862, 4085603)),
+    ("position 3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     (14, 191, 2812, 43238, 674624)),
+    ("position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     (6, 264, 9467, 422333)),
+    ("position 5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     (44, 1486, 62379, 2103487)),
+    ("position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     (46, 2079, 89890, 3894594)),
+]
+SUITE_DEPTH = 3  # depth the reference positions are checked at unless another one is given
+
+
+def perft(gamestate, depth):
+    # number of leaf nodes of the legal move tree, the same generator the search uses
+    if depth == 0:
+        return 1
+    moves = gamestate.getValidMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gamestate.makeMove(move)
+        nodes += perft(gamestate, depth - 1)
+        gamestate.undoMove()
+    return nodes
+
+
+def perft_root_move(fen, backend, move_id, depth):
+    # runs in a worker process, every worker builds its own game state from the fen
+    gamestate = ChessEngine.new_game_state(fen, backend)
+    move = next(move for move in gamestate.getValidMoves() if move.moveID == move_id)
+    gamestate.makeMove(move)
+    return perft(gamestate, depth - 1)
+
+
+def divide(fen, depth, backend="mailbox", processes=1):
+    # node count below every root move, the root moves are split over a process pool if processes > 1
+    if depth < 1:
+        raise ValueError(f"perft divides the root moves, the depth has to be at least 1, not {depth}")
+    gamestate = ChessEngine.new_game_state(fen, backend)
+    moves = gamestate.getValidMoves()
+    if processes > 1:
+        with ProcessPoolExecutor(processes) as pool:
+            counts = pool.map(perft_root_move, [fen] * len(moves), [backend] * len(moves),
+                              [move.moveID for move in moves], [depth] * len(moves))
+            return list(zip((move.getUciNotation() for move in moves), counts))
+
+    counts = []
+    for move in moves:
+        gamestate.makeMove(move)
+        counts.append((move.getUciNotation(), perft(gamestate, depth - 1)))
+        gamestate.undoMove()
+    return counts
+
+
+def run(fen, depth, backend, processes, print_divide):
+    start = time.perf_counter()
+    counts = divide(fen, depth, backend, processes)
+    seconds = time.perf_counter() - start
+    nodes = sum(count for move, count in counts)
+    if print_divide:
+        for move, count in sorted(counts):
+            print(f"{move}: {count}")
+    print(f"Nodes: {nodes}  Time: {seconds:.2f}s  Nodes/sec: {nodes / max(seconds, 1e-9):.0f}")
+    return nodes
+
+
+def run_suite(depth, backend, processes):
+    failed = 0
+    for name, fen, expected_counts in REFERENCE_POSITIONS:
+        position_depth = min(depth, len(expected_counts))
+        print(f"{name} ({fen}) depth {position_depth}")
+        nodes = run(fen, position_depth, backend, processes, False)
+        if nodes != expected_counts[position_depth - 1]:
+            print(f"  FAILED, expected {expected_counts[position_depth - 1]} nodes")
+            failed += 1
+    print("All reference positions passed." if not failed else f"{failed} reference position(s) failed.")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count the leaf nodes of the move tree to check and time the move generator.")
+    parser.add_argument("depth", nargs="?", type=int, default=SUITE_DEPTH)
+    parser.add_argument("--fen", help="position to count, the reference positions are checked when left out")
+    parser.add_argument("--backend", default=cfg["ai"]["backend"], choices=("mailbox", "bitboard"))
+    parser.add_argument("--processes", type=int, default=1, help="split the root moves over this many processes")
+    parser.add_argument("--divide", action="store_true", help="print the node count below every root move")
+    args = parser.parse_args()
+    if args.depth < 1:
+        parser.error("depth must be at least 1")
+
+    if args.fen is None:
+        raise SystemExit(run_suite(args.depth, args.backend, args.processes))
+    run(args.fen, args.depth, args.backend, args.processes, args.divide)
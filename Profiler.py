@@ -0,0 +1,167 @@
+import argparse
+import cProfile
+import functools
+import io
+import os
+import pstats
+import time
+import tracemalloc
+
+import ChessAI
+import ChessBitboard
+import ChessEngine
+
+# opt-in instrumentation of the hot path, set up by the profiling section of the config: install wraps the phases
+# below with a call counter and a timer. nothing is wrapped while profiling is off, so the engine runs at full speed.
+# the game states keep bound methods of the piece generators, so only game states created after install are counted
+PROFILE = ChessAI.cfg["profiling"]
+GAME_STATE_PHASES = ["getValidMoves", "generateMoves", "checkForPinsAndChecks", "getPawnMoves", "getKnightMoves",
+                     "getBishopMoves", "getRookMoves", "getQueenMoves", "getKingMoves", "getCastleMoves", "hasLegalMove", "getLegalMove",
+                     "makeMove", "undoMove"]
+SEARCH_PHASES = ["find_move_v4", "quiescence_v4", "score_board_v4", "score_board_v5"]
+REPORT_FUNCTIONS = 30  # functions of the cProfile report
+REPORT_ALLOCATIONS = 15  # lines of the tracemalloc report
+
+installed = False
+phases = {}  # name -> Phase, in the order they are reported
+profile = None  # the cProfile.Profile the searches run under
+searches = 0
+search_seconds = 0.0
+peak_memory = 0  # bytes allocated at most during a search
+snapshot = None  # the tracemalloc snapshot at the end of the last search
+
+
+class Phase:
+    __slots__ = ("calls", "seconds", "active")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.active = False  # a recursive call is only timed once, by the outermost call
+
+
+def timed(function, phase):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        phase.calls += 1
+        if phase.active:
+            return function(*args, **kwargs)
+        phase.active = True
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            phase.seconds += time.perf_counter() - start
+            phase.active = False
+    return wrapper
+
+
+def install(cprofile=None, trace_memory=None):
+    # wraps the phases and find_best_move, the settings of the config are used for the ones not given
+    global installed, profile
+    if installed:
+        return
+    installed = True
+    cprofile = PROFILE["cprofile"] if cprofile is None else cprofile
+    trace_memory = PROFILE["tracemalloc"] if trace_memory is None else trace_memory
+
+    for cls in (ChessEngine.GameState, ChessBitboard.BitboardGameState):
+        for name in GAME_STATE_PHASES:
+            # the bitboard game state calls the methods it overrides from the mailbox one, both are counted
+            if name in cls.__dict__:
+                phase = phases.setdefault(f"{cls.__name__}.{name}", Phase())
+                setattr(cls, name, timed(cls.__dict__[name], phase))
+    for name in SEARCH_PHASES:
+        setattr(ChessAI, name, timed(getattr(ChessAI, name), phases.setdefault(name, Phase())))
+
+    if cprofile:
+        profile = cProfile.Profile()
+    ChessAI.find_best_move = profiled_search(ChessAI.find_best_move, trace_memory)
+
+
+def profiled_search(find_best_move, trace_memory):
+    # the searches of helper processes (threads > 1) are not profiled, only the one of this process
+    @functools.wraps(find_best_move)
+    def wrapper(*args, **kwargs):
+        global searches, search_seconds, peak_memory, snapshot
+        if trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        if profile is not None:
+            profile.enable()
+        start = time.perf_counter()
+        try:
+            return find_best_move(*args, **kwargs)
+        finally:
+            search_seconds += time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+            if trace_memory:
+                peak_memory = max(peak_memory, tracemalloc.get_traced_memory()[1])
+                snapshot = tracemalloc.take_snapshot()
+            searches += 1
+    return wrapper
+
+
+def reset():
+    global searches, search_seconds, peak_memory, snapshot
+    for phase in phases.values():
+        phase.calls = 0
+        phase.seconds = 0.0
+    if profile is not None:
+        profile.clear()
+    searches = 0
+    search_seconds = 0.0
+    peak_memory = 0
+    snapshot = None
+
+
+def report():
+    lines = [f"{searches} searches in {search_seconds:.3f}s", "",
+             f"{'phase':<45}{'calls':>12}{'seconds':>12}{'us per call':>14}{'% search':>10}"]
+    for name, phase in phases.items():
+        if phase.calls:
+            lines.append(f"{name:<45}{phase.calls:>12}{phase.seconds:>12.3f}{phase.seconds / phase.calls * 1e6:>14.2f}"
+                         f"{phase.seconds / max(search_seconds, 1e-9):>10.1%}")
+    lines.append("(the time of a phase includes the phases it calls)")
+
+    if profile is not None and searches:
+        stream = io.StringIO()
+        pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats(REPORT_FUNCTIONS)
+        lines += ["", "cProfile, sorted by cumulative time:", stream.getvalue().rstrip()]
+    if snapshot is not None:
+        lines += ["", f"Peak memory during a search: {peak_memory / 1024:.1f} KB",
+                  "Memory still allocated after the last search, by line:"]
+        lines += [f"  {statistic}" for statistic in snapshot.statistics("lineno")[:REPORT_ALLOCATIONS]]
+    return "\n".join(lines) + "\n"
+
+
+def write_report(path=None):
+    # the path is relative to this folder, the one of the config by default
+    if not installed:
+        return None
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), path or PROFILE["report"])
+    with open(path, "w") as f:
+        f.write(report())
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search positions with the profiling hooks and write a report.")
+    parser.add_argument("fen", nargs="*", help="positions to search, the start position by default")
+    parser.add_argument("--depth", type=int, default=ChessAI.DEPTH)
+    parser.add_argument("--backend", default=ChessAI.cfg["ai"]["backend"], choices=("mailbox", "bitboard"))
+    parser.add_argument("--cprofile", action="store_true", help="run the searches under cProfile")
+    parser.add_argument("--tracemalloc", action="store_true", help="trace the memory the searches allocate")
+    parser.add_argument("--report", help=f"report file, {PROFILE['report']} by default")
+    args = parser.parse_args()
+
+    install(args.cprofile or PROFILE["cprofile"], args.tracemalloc or PROFILE["tracemalloc"])
+    for fen in args.fen or [None]:
+        gamestate = ChessEngine.new_game_state(fen, args.backend)
+        transposition_table = ChessAI.TranspositionTable(ChessAI.HASH_SIZE_MB, shared=False)
+        ChessAI.find_best_move(gamestate, gamestate.getValidMoves(), transposition_table, False, args.depth, 0, 0)
+        transposition_table.close()
+    print(report(), end="")
+    print(f"Written to {write_report(args.report)}")
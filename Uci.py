@@ -0,0 +1,170 @@
+import os
+import sys
+import threading
+
+import ChessAI
+import ChessEngine
+import Profiler
+
+# speaks the UCI protocol over stdin and stdout, so the engine runs headless under a chess GUI or a match tool
+# http://wbec-ridderkerk.nl/html/UCIProtocol.html
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+ENGINE_NAME = "ichessebaeume1 Chess"
+MOVES_TO_GO = 30  # moves the remaining clock time is shared over when the GUI does not send movestogo
+MOVE_OVERHEAD = 0.05  # seconds kept back per move for the communication with the GUI
+MAX_HASH_MB = 1024
+
+
+def send(line):
+    print(line, flush=True)
+
+
+def uci_score(score):
+    # scores are in pawns from the side to move, a checkmate score is shown as the number of moves to it: the
+    # search scores a mate as CHECKMATE minus the plies to it
+    if abs(score) >= ChessAI.MATE_BOUND:
+        moves = (round(ChessAI.CHECKMATE - abs(score)) + 1) // 2
+        return f"mate {moves if score > 0 else -moves}"
+    return f"cp {round(score * 100)}"
+
+
+class UciEngine:
+    def __init__(self):
+        self.backend = ChessAI.cfg["ai"]["backend"]
+        self.hash_size_mb = ChessAI.HASH_SIZE_MB
+        self.transposition_table = ChessAI.TranspositionTable(self.hash_size_mb, shared=ChessAI.THREADS > 1)
+        self.gamestate = ChessEngine.new_game_state(START_FEN, self.backend)
+        self.search_thread = None
+        self.stop_event = threading.Event()
+
+    def run(self):
+        for line in sys.stdin:
+            words = line.split()
+            if not words:
+                continue
+            command, arguments = words[0], words[1:]
+            if command == "uci":
+                send(f"id name {ENGINE_NAME}")
+                send("id author ichessebaeume1")
+                send(f"option name Hash type spin default {self.hash_size_mb} min 1 max {MAX_HASH_MB}")
+                send(f"option name Threads type spin default {ChessAI.THREADS} min 1 max {os.cpu_count() or 1}")
+                send("uciok")
+            elif command == "isready":
+                send("readyok")
+            elif command == "setoption":
+                self.stop()
+                self.set_option(arguments)
+            elif command == "ucinewgame":
+                self.stop()
+                self.transposition_table.clear()
+            elif command == "position":
+                self.stop()
+                self.set_position(arguments)
+            elif command == "go":
+                self.stop()
+                self.go(arguments)
+            elif command == "stop":
+                self.stop()
+            elif command == "quit":
+                self.stop()
+                break
+        self.transposition_table.close()
+        Profiler.write_report()
+
+    def set_option(self, arguments):
+        # setoption name <name> value <value>, the name may contain spaces
+        if "name" not in arguments or "value" not in arguments:
+            return
+        name = " ".join(arguments[arguments.index("name") + 1:arguments.index("value")]).lower()
+        value = arguments[arguments.index("value") + 1]
+        if name == "hash":
+            self.hash_size_mb = max(1, min(int(value), MAX_HASH_MB))
+        elif name == "threads":
+            ChessAI.THREADS = max(1, int(value))
+        else:
+            return
+        # both options need a new table, a shared one when more than one process searches
+        self.transposition_table.close()
+        self.transposition_table = ChessAI.TranspositionTable(self.hash_size_mb, shared=ChessAI.THREADS > 1)
+
+    def set_position(self, arguments):
+        # position [startpos | fen <fen>] [moves <move> ...]
+        moves = arguments.index("moves") if "moves" in arguments else len(arguments)
+        fen = " ".join(arguments[1:moves]) if arguments[0] == "fen" else START_FEN
+        self.gamestate = ChessEngine.new_game_state(fen, self.backend)
+        for uci_move in arguments[moves + 1:]:
+            move = next((move for move in self.gamestate.getValidMoves() if move.getUciNotation() == uci_move), None)
+            if move is None:
+                break
+            self.gamestate.makeMove(move)
+
+    def go(self, arguments):
+        limits = {}
+        for name, value in zip(arguments, arguments[1:]):
+            if name in ("depth", "movetime", "wtime", "btime", "winc", "binc", "movestogo", "nodes"):
+                limits[name] = int(value)
+
+        # a plain go searches with the limits of the config, otherwise only the given limits count
+        infinite = "infinite" in arguments
+        configured = not infinite and not limits
+        max_depth = limits.get("depth", ChessAI.DEPTH if configured else ChessAI.MAX_PLY)
+        node_limit = limits.get("nodes", ChessAI.NODE_LIMIT if configured else 0)
+        time_limit = ChessAI.TIME_LIMIT if configured else 0
+        if "movetime" in limits:
+            time_limit = limits["movetime"] / 1000
+        else:
+            clock, increment = ("wtime", "winc") if self.gamestate.white_to_move else ("btime", "binc")
+            if clock in limits:
+                remaining = limits[clock] / 1000
+                time_limit = remaining / limits.get("movestogo", MOVES_TO_GO) + limits.get(increment, 0) / 2000
+                time_limit = max(0.01, min(time_limit, remaining - MOVE_OVERHEAD))
+
+        self.stop_event.clear()
+        self.search_thread = threading.Thread(target=self.search, args=(max_depth, time_limit, node_limit, infinite),
+                                              daemon=True)
+        self.search_thread.start()
+
+    def search(self, max_depth, time_limit, node_limit, infinite):
+        gamestate = self.gamestate
+        valid_moves = gamestate.getValidMoves()
+        pv = []
+
+        def progress(stats):
+            # called by the search after every completed iteration, while the game state is back at the root
+            if stats.best_move is None:
+                return
+            pv[:] = ChessAI.principal_variation(gamestate, self.transposition_table, stats.best_move, stats.depth)
+            send(f"info depth {stats.depth} seldepth {stats.seldepth} score {uci_score(stats.score)} "
+                 f"nodes {stats.nodes} nps {stats.nps} time {int(stats.seconds * 1000)} "
+                 f"pv {' '.join(move.getUciNotation() for move in pv)}")
+
+        best_move = None
+        if valid_moves:
+            best_move, stats = ChessAI.find_best_move(gamestate, valid_moves, self.transposition_table, False,
+                                                      max_depth, time_limit, node_limit, self.stop_event, progress)
+            if best_move is None:
+                best_move = valid_moves[0]
+            if not stats.book:
+                send(f"info nodes {stats.total_nodes} nps {stats.nps} time {int(stats.seconds * 1000)} "
+                     f"hashfull {stats.hashfull}")
+        # in infinite mode the best move may only be sent after the GUI said stop
+        if infinite:
+            self.stop_event.wait()
+        if best_move is None:
+            send("bestmove 0000")
+        elif len(pv) > 1 and pv[0].moveID == best_move.moveID:
+            send(f"bestmove {best_move.getUciNotation()} ponder {pv[1].getUciNotation()}")
+        else:
+            send(f"bestmove {best_move.getUciNotation()}")
+
+    def stop(self):
+        if self.search_thread is not None:
+            self.stop_event.set()
+            self.search_thread.join()
+            self.search_thread = None
+
+
+if __name__ == "__main__":
+    if ChessAI.cfg["profiling"]["enabled"]:
+        Profiler.install()
+    UciEngine().run()